@@ -1,9 +1,31 @@
 import sublime
 import sublime_plugin
+import sys
 import os.path
 import subprocess
 import re
 import time
+import threading
+import Queue
+import struct
+import zlib
+import hashlib
+import fnmatch
+import json
+import collections
+import difflib
+import traceback
+import signal
+
+try:
+    import sqlite3
+except (ImportError):
+    sqlite3 = None
+
+try:
+    from xml.parsers import expat
+except (ImportError):
+    expat = None
 
 
 class RepositoryNotFoundError(Exception):
@@ -14,7 +36,30 @@ class NotFoundError(Exception):
     pass
 
 
-file_status_cache = {}
+class NativeStatusError(Exception):
+    pass
+
+
+# Raised when a VCS command runs past the timeout
+class ProcessTimeoutError(OSError):
+    pass
+
+
+# Raised instead of running a VCS command in a working copy the circuit
+# breaker paused
+class ProcessBlockedError(OSError):
+    pass
+
+
+vcs_cache = {}
+binary_path_cache = {}
+git_repositories = {}
+svn_working_copies = {}
+hg_manifests = {}
+restored_roots = set()
+view_changes = {}
+view_blames = {}
+blame_panels = {}
 
 
 class TortoiseCommand():
@@ -23,39 +68,204 @@ class TortoiseCommand():
             return self.window.active_view().file_name()
         return paths[0] if paths else self.window.active_view().file_name()
 
+    def get_paths(self, paths):
+        if paths == True or not paths:
+            return [self.window.active_view().file_name()]
+        return list(paths)
+
+    # Splits the paths up by working copy, keeping the order they were
+    # selected in, so each working copy only needs a single command
+    def group_paths(self, paths):
+        groups = []
+        roots = {}
+        for path in paths:
+            vcs = self.get_vcs(path)
+            if vcs.root_dir not in roots:
+                roots[vcs.root_dir] = (vcs, [])
+                groups.append(roots[vcs.root_dir])
+            roots[vcs.root_dir][1].append(path)
+        return groups
+
     def get_vcs(self, path):
         settings = sublime.load_settings('Tortoise.sublime-settings')
 
         if path == None:
             raise NotFoundError('Unable to run commands on an unsaved file')
-        vcs = None
 
-        try:
-            vcs = TortoiseSVN(settings.get('svn_tortoiseproc_path'), path)
-        except (RepositoryNotFoundError):
-            pass
+        dir = path if os.path.isdir(path) else os.path.dirname(path)
+        binary_paths = (settings.get('svn_tortoiseproc_path'),
+            settings.get('git_tortoiseproc_path'),
+            settings.get('hg_hgtk_path'), settings.get('svn_path'),
+            settings.get('git_path'), settings.get('hg_path'))
 
-        try:
-            vcs = TortoiseGit(settings.get('git_tortoiseproc_path'), path)
-        except (RepositoryNotFoundError):
-            pass
+        entry = vcs_cache.get(dir)
+        if entry == None or not entry.is_valid(binary_paths,
+                settings.get('cache_length')):
+            entry = VCSCacheEntry(dir, binary_paths)
+            try:
+                entry.vcs = self.find_vcs(dir, binary_paths)
+            except (NotFoundError) as (exception):
+                entry.error = exception
+            vcs_cache[dir] = entry
+            if settings.get('debug'):
+                print 'Resolving working copy for %s' % dir
 
-        try:
-            vcs = TortoiseHg(settings.get('hg_hgtk_path'), path)
-        except (RepositoryNotFoundError):
-            pass
+        if entry.error != None:
+            raise entry.error
 
-        if vcs == None:
+        if entry.vcs == None:
             raise NotFoundError('The current file does not appear to be in an ' +
                 'SVN, Git or Mercurial working copy')
 
-        return vcs
+        return entry.vcs
+
+    def find_vcs(self, dir, binary_paths):
+        start_time = time.time()
+        try:
+            marker, root_dir = find_root(dir)
+        except (RepositoryNotFoundError):
+            metrics.record('find_root', None, time.time() - start_time)
+            return None
+        metrics.record('find_root', root_dir, time.time() - start_time)
+
+        if marker == '.svn':
+            return TortoiseSVN(binary_paths[0], binary_paths[3], root_dir)
+        if marker == '.git':
+            return TortoiseGit(binary_paths[1], binary_paths[4], root_dir)
+        return TortoiseHg(binary_paths[2], binary_paths[5], root_dir)
+
+    def get_status(self, vcs, path):
+        status = status_memo.get(path)
+        if status != None:
+            return status
+        status = vcs.get_status(path, False)
+        if status == None:
+            settings = sublime.load_settings('Tortoise.sublime-settings')
+            return settings.get('status_fallback', '')
+        status_memo.set(path, status)
+        return status
+
+    # The statuses are returned in the same order as the paths. Unknown
+    # statuses are the status_fallback setting, or None without fallback.
+    def get_statuses(self, paths, fallback=True):
+        statuses = {}
+        missing = []
+        for path in paths:
+            status = status_memo.get(path)
+            if status != None:
+                statuses[path] = status
+            else:
+                missing.append(path)
+
+        for vcs, root_paths in self.group_paths(missing):
+            for path, status in zip(root_paths, vcs.get_statuses(root_paths)):
+                if status != None:
+                    status_memo.set(path, status)
+                statuses[path] = status
+
+        if fallback:
+            settings = sublime.load_settings('Tortoise.sublime-settings')
+            fallback = settings.get('status_fallback', '')
+        else:
+            fallback = None
+        return [statuses[path] if statuses[path] != None else fallback
+            for path in paths]
 
     def menus_enabled(self):
         settings = sublime.load_settings('Tortoise.sublime-settings')
         return settings.get('enable_menus', True)
 
 
+# Walks up from path once, listing each folder a single time. The closest
+# working copy wins, except that SVN (pre-1.7) has a .svn folder in every
+# folder, so its root is the outermost of a run of folders containing .svn.
+def find_root(path):
+    marker = None
+    root_dir = None
+    last_dir = None
+    cur_dir = path if os.path.isdir(path) else os.path.dirname(path)
+    while cur_dir != last_dir:
+        try:
+            names = set(os.listdir(cur_dir))
+        except (OSError):
+            names = set()
+
+        if marker == '.svn':
+            if '.svn' not in names:
+                break
+            root_dir = cur_dir
+        else:
+            for name in ['.hg', '.git', '.svn']:
+                if name in names:
+                    marker = name
+                    root_dir = cur_dir
+                    break
+            if marker in ['.hg', '.git']:
+                break
+
+        last_dir = cur_dir
+        cur_dir = os.path.dirname(cur_dir)
+
+    if root_dir == None:
+        raise RepositoryNotFoundError('Unable to find .svn, .git or .hg ' +
+            'directory')
+    return (marker, root_dir)
+
+
+# Worktrees and submodules use a .git file pointing at the real git dir
+def find_git_dir(root_dir):
+    git_dir = os.path.join(root_dir, '.git')
+    if os.path.isfile(git_dir):
+        try:
+            f = open(git_dir, 'r')
+            try:
+                line = f.readline().strip()
+            finally:
+                f.close()
+        except (IOError):
+            return git_dir
+        if line.startswith('gitdir:'):
+            git_dir = os.path.normpath(os.path.join(root_dir,
+                line[7:].strip()))
+    return git_dir
+
+
+class VCSCacheEntry():
+    def __init__(self, dir, binary_paths):
+        self.dir = dir
+        self.binary_paths = binary_paths
+        self.vcs = None
+        self.error = None
+        self.time = time.time()
+        self.mtimes = self.get_mtimes()
+
+    # Adding or removing a .svn, .git or .hg folder changes the modification
+    # time of the folder containing it, so comparing the modification times
+    # of all parent folders is enough to notice repositories coming and going
+    def get_mtimes(self):
+        mtimes = []
+        last_dir = None
+        cur_dir = self.dir
+        while cur_dir != last_dir:
+            try:
+                mtimes.append(os.stat(cur_dir).st_mtime)
+            except (OSError):
+                mtimes.append(None)
+            last_dir = cur_dir
+            cur_dir = os.path.dirname(cur_dir)
+        return mtimes
+
+    def is_valid(self, binary_paths, cache_length):
+        if binary_paths != self.binary_paths:
+            return False
+        if cache_length != None and self.time > time.time() - cache_length:
+            return True
+        if self.get_mtimes() != self.mtimes:
+            return False
+        self.time = time.time()
+        return True
+
+
 def handles_not_found(fn):
     def handler(self, *args, **kwargs):
         try:
@@ -87,18 +297,34 @@ class TortoiseExploreCommand(sublime_plugin.WindowCommand, TortoiseCommand):
 class TortoiseCommitCommand(sublime_plugin.WindowCommand, TortoiseCommand):
     @handles_not_found
     def run(self, paths=None):
-        path = self.get_path(paths)
-        self.get_vcs(path).commit(path if os.path.isdir(path) else None)
+        paths = self.get_paths(paths)
+        if not os.path.isdir(paths[0]):
+            self.get_vcs(paths[0]).commit()
+            return
+        for vcs, root_paths in self.group_paths(paths):
+            vcs.commit(root_paths)
 
     @invisible_when_not_found
     def is_visible(self, paths=None):
         if not self.menus_enabled():
             return False
-        path = self.get_path(paths)
-        if not path:
+        paths = self.get_paths(paths)
+        if None in paths:
             return False
-        self.get_vcs(path)
-        return os.path.isdir(path)
+        self.group_paths(paths)
+        return all([os.path.isdir(path) for path in paths])
+
+    # Committing from a file commits the whole working copy, so only folders
+    # that are known to have no changes disable it
+    @invisible_when_not_found
+    def is_enabled(self, paths=None):
+        paths = self.get_paths(paths)
+        if None in paths:
+            return False
+        if not all([os.path.isdir(path) for path in paths]):
+            return True
+        statuses = self.get_statuses(paths, False)
+        return any([status in ['M', 'C', None] for status in statuses])
 
 
 class TortoiseStatusCommand(sublime_plugin.WindowCommand, TortoiseCommand):
@@ -149,7 +375,7 @@ class TortoiseLogCommand(sublime_plugin.WindowCommand, TortoiseCommand):
         vcs = self.get_vcs(path)
         if os.path.isdir(path):
             return True
-        return path and vcs.get_status(path) in \
+        return path and self.get_status(vcs, path) in \
             ['A', '', 'M', 'R', 'C', 'U']
 
     @invisible_when_not_found
@@ -157,9 +383,61 @@ class TortoiseLogCommand(sublime_plugin.WindowCommand, TortoiseCommand):
         path = self.get_path(paths)
         if os.path.isdir(path):
             return True
-        return path and self.get_vcs(path).get_status(path) in \
+        return path and self.get_status(self.get_vcs(path), path) in \
             ['', 'M', 'R', 'C', 'U']
 
+
+# Browses the history of a file or folder in a quick panel instead of the
+# log dialog. History is read a page at a time on the history worker, one
+# page ahead of what is shown, and the last item loads the next page.
+class TortoiseQuickLogCommand(TortoiseLogCommand):
+    @handles_not_found
+    def run(self, paths=None):
+        path = self.get_path(paths)
+        self.vcs = self.get_vcs(path)
+        self.history = self.vcs.get_log_history(path if paths else
+            self.vcs.root_dir)
+        if self.history.entries or self.history.complete:
+            self.show()
+        else:
+            self.load(self.show, 0)
+
+    def load(self, callback, priority):
+        settings = sublime.load_settings('Tortoise.sublime-settings')
+        if callback != None:
+            sublime.status_message('Loading log...')
+        history_worker.add((self.vcs.root_dir, 'log', self.history.path),
+            priority, self.vcs.load_log_page, self.history,
+            settings.get('log_page_size', 100), callback)
+
+    def show(self):
+        self.entries = list(self.history.entries)
+        items = [[entry['summary'], '%s  %s  %s' % (entry['revision'],
+            entry['author'], entry['date'])] for entry in self.entries]
+        if not self.history.complete:
+            items.append(['Load more...', '%d entries loaded' %
+                len(self.entries)])
+            self.load(None, 1)
+        if not items:
+            sublime.status_message('No history for ' + self.history.path)
+            return
+        self.window.show_quick_panel(items, self.on_done)
+
+    def on_done(self, index):
+        if index == -1:
+            return
+        if index < len(self.entries):
+            history_worker.add((self.vcs.root_dir, 'log revision'), 0,
+                self.vcs.load_log_revision, self.window, self.history.path,
+                self.entries[index])
+        elif len(self.history.entries) > len(self.entries) or \
+                self.history.complete:
+            # The quick panel can't be shown again while it is closing
+            sublime.set_timeout(self.show, 10)
+        else:
+            self.load(self.show, 0)
+
+
 class TortoiseBlameCommand(sublime_plugin.WindowCommand, TortoiseCommand):
     @handles_not_found
     def run(self, paths=None):
@@ -174,7 +452,7 @@ class TortoiseBlameCommand(sublime_plugin.WindowCommand, TortoiseCommand):
         if os.path.isdir(path):
             return False
         vcs = self.get_vcs(path)
-        return path and vcs.get_status(path) in \
+        return path and self.get_status(vcs, path) in \
             ['A', '', 'M', 'R', 'C', 'U']
 
     @invisible_when_not_found
@@ -182,427 +460,3783 @@ class TortoiseBlameCommand(sublime_plugin.WindowCommand, TortoiseCommand):
         path = self.get_path(paths)
         if os.path.isdir(path):
             return False
-        return path and self.get_vcs(path).get_status(path) in \
+        return path and self.get_status(self.get_vcs(path), path) in \
             ['A', '', 'M', 'R', 'C', 'U']
 
 class TortoiseDiffCommand(sublime_plugin.WindowCommand, TortoiseCommand):
     @handles_not_found
     def run(self, paths=None):
-        path = self.get_path(paths)
-        self.get_vcs(path).diff(path if paths else None)
+        for vcs, root_paths in self.group_paths(self.get_paths(paths)):
+            vcs.diff(root_paths)
 
     @invisible_when_not_found
     def is_visible(self, paths=None):
         if not self.menus_enabled():
             return False
-        path = self.get_path(paths)
-        vcs = self.get_vcs(path)
-        if os.path.isdir(path):
-            return True
-        return vcs.get_status(path) in \
-            ['A', '', 'M', 'R', 'C', 'U']
+        paths = self.get_paths(paths)
+        statuses = self.get_statuses(paths)
+        for path, status in zip(paths, statuses):
+            if not os.path.isdir(path) and status not in \
+                    ['A', '', 'M', 'R', 'C', 'U']:
+                return False
+        return True
 
     @invisible_when_not_found
     def is_enabled(self, paths=None):
-        path = self.get_path(paths)
-        if os.path.isdir(path):
-            return True
-        vcs = self.get_vcs(path)
-        if isinstance(vcs, TortoiseHg):
-            return vcs.get_status(path) in ['M']
-        else:
-            return vcs.get_status(path) in ['A', 'M', 'R', 'C', 'U']
+        paths = self.get_paths(paths)
+        statuses = self.get_statuses(paths)
+        for path, status in zip(paths, statuses):
+            if os.path.isdir(path):
+                return True
+            if isinstance(self.get_vcs(path), TortoiseHg):
+                if status in ['M']:
+                    return True
+            elif status in ['A', 'M', 'R', 'C', 'U']:
+                return True
+        return False
 
 
 class TortoiseAddCommand(sublime_plugin.WindowCommand, TortoiseCommand):
     @handles_not_found
     def run(self, paths=None):
-        path = self.get_path(paths)
-        self.get_vcs(path).add(path)
+        for vcs, root_paths in self.group_paths(self.get_paths(paths)):
+            vcs.add(root_paths)
 
     @invisible_when_not_found
     def is_visible(self, paths=None):
         if not self.menus_enabled():
             return False
-        path = self.get_path(paths)
-        return self.get_vcs(path).get_status(path) in ['D', '?']
+        statuses = self.get_statuses(self.get_paths(paths))
+        return all([status in ['D', '?'] for status in statuses])
 
 
 class TortoiseRemoveCommand(sublime_plugin.WindowCommand, TortoiseCommand):
     @handles_not_found
     def run(self, paths=None):
-        path = self.get_path(paths)
-        self.get_vcs(path).remove(path)
+        for vcs, root_paths in self.group_paths(self.get_paths(paths)):
+            vcs.remove(root_paths)
 
     @invisible_when_not_found
     def is_visible(self, paths=None):
         if not self.menus_enabled():
             return False
-        path = self.get_path(paths)
-        return self.get_vcs(path).get_status(path) in \
-            ['A', '', 'M', 'R', 'C', 'U']
+        statuses = self.get_statuses(self.get_paths(paths))
+        return all([status in ['A', '', 'M', 'R', 'C', 'U']
+            for status in statuses])
 
     @invisible_when_not_found
     def is_enabled(self, paths=None):
-        path = self.get_path(paths)
-        if os.path.isdir(path):
-            return True
-        return self.get_vcs(path).get_status(path) in ['']
+        paths = self.get_paths(paths)
+        statuses = self.get_statuses(paths)
+        for path, status in zip(paths, statuses):
+            if os.path.isdir(path) or status in ['']:
+                return True
+        return False
 
 
 class TortoiseRevertCommand(sublime_plugin.WindowCommand, TortoiseCommand):
     @handles_not_found
     def run(self, paths=None):
-        path = self.get_path(paths)
-        self.get_vcs(path).revert(path)
+        for vcs, root_paths in self.group_paths(self.get_paths(paths)):
+            vcs.revert(root_paths)
 
     @invisible_when_not_found
     def is_visible(self, paths=None):
         if not self.menus_enabled():
             return False
-        path = self.get_path(paths)
-        return self.get_vcs(path).get_status(path) in \
-            ['A', '', 'M', 'R', 'C', 'U']
+        statuses = self.get_statuses(self.get_paths(paths))
+        return all([status in ['A', '', 'M', 'R', 'C', 'U']
+            for status in statuses])
 
     @invisible_when_not_found
     def is_enabled(self, paths=None):
-        path = self.get_path(paths)
-        if os.path.isdir(path):
-            return True
-        return self.get_vcs(path).get_status(path) in \
-            ['A', 'M', 'R', 'C', 'U']
+        statuses = self.get_statuses(self.get_paths(paths))
+        return any([status in ['A', 'M', 'R', 'C', 'U']
+            for status in statuses])
 
 
-class ForkGui():
-    def __init__(self, cmd, cwd):
-        subprocess.Popen(cmd, stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            cwd=cwd)
+# Toggles the blame of the active file. Each line is annotated in a read-only
+# panel in another group, which scrolls along with the file, and the status
+# bar shows the full blame of the line with the cursor.
+class TortoiseInlineBlameCommand(sublime_plugin.WindowCommand,
+        TortoiseCommand):
+    @handles_not_found
+    def run(self):
+        view = self.window.active_view()
+        if view.id() in view_blames:
+            close_blame(view)
+            return
+        self.get_vcs(view.file_name())
+        state = ViewBlame()
+        self.open_panel(view, state)
+        view_blames[view.id()] = state
+        blame_panels[state.panel.id()] = view
+        listener = TortoiseBlameListener()
+        listener.start(view)
+        listener.sync(view, state)
 
+    def open_panel(self, view, state):
+        window = self.window
+        if window.num_groups() == 1:
+            window.run_command('set_layout', {'cols': [0.0, 0.75, 1.0],
+                'rows': [0.0, 1.0], 'cells': [[0, 0, 1, 1], [1, 0, 2, 1]]})
+            state.layout_changed = True
+        group = window.num_groups() - 1
+        if window.get_view_index(view)[0] == group:
+            group = 0
 
-class Tortoise():
-    def find_root(self, name, path, find_first=True):
-        root_dir = None
-        last_dir = None
-        cur_dir  = path if os.path.isdir(path) else os.path.dirname(path)
-        while cur_dir != last_dir:
-            if root_dir != None and not os.path.exists(os.path.join(cur_dir,
-                    name)):
-                break
-            if os.path.exists(os.path.join(cur_dir, name)):
-                root_dir = cur_dir
-                if find_first:
-                    break
-            last_dir = cur_dir
-            cur_dir  = os.path.dirname(cur_dir)
+        window.focus_group(group)
+        panel = window.new_file()
+        panel.set_scratch(True)
+        panel.set_read_only(True)
+        panel.set_name('Blame ' + os.path.basename(view.file_name()))
+        for name, value in [('word_wrap', False), ('line_numbers', False),
+                ('gutter', False), ('draw_indent_guides', False)]:
+            panel.settings().set(name, value)
+        state.panel = panel
+        window.focus_view(view)
 
-        if root_dir == None:
-            raise RepositoryNotFoundError('Unable to find ' + name +
-                ' directory')
-        self.root_dir = root_dir
+    def is_visible(self):
+        return self.menus_enabled()
 
-    def set_binary_path(self, path_suffix, binary_name, setting_name):
-        root_drive = os.path.expandvars('%HOMEDRIVE%\\')
+    @invisible_when_not_found
+    def is_enabled(self):
+        path = self.window.active_view().file_name()
+        return self.get_status(self.get_vcs(path), path) in \
+            ['', 'M', 'R', 'C', 'U']
 
-        possible_dirs = [
-            'Program Files\\',
-            'Program Files (x86)\\'
+
+# Shows the timings recorded in metrics in a new scratch view, either as a
+# table per working copy or, with output "json", as JSON for exporting
+class TortoisePerformanceReportCommand(sublime_plugin.WindowCommand):
+    def run(self, output='text'):
+        summary = metrics.summarize()
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name('Tortoise Performance Report')
+        if output == 'json':
+            text = json.dumps(summary, indent=4, sort_keys=True)
+            view.set_syntax_file('Packages/JavaScript/JSON.tmLanguage')
+        else:
+            text = self.format_summary(summary)
+        edit = view.begin_edit()
+        view.insert(edit, 0, text)
+        view.end_edit(edit)
+
+    def format_summary(self, summary):
+        started = time.strftime('%Y-%m-%d %H:%M:%S',
+            time.localtime(summary['started']))
+        cache = summary['cache']
+        lines = [
+            'Tortoise performance since %s, %d operations recorded' % (
+                started, summary['records']),
+            '',
+            'Status cache: %d entries weighing %d, %d hits and %d misses' % (
+                cache['entries'], cache['size'], cache['hits'],
+                cache['misses'])
         ]
 
-        for dir in possible_dirs:
-            path = root_drive + dir + path_suffix
-            if os.path.exists(path):
-                self.path = path
-                return
+        roots = {}
+        for operation in summary['operations']:
+            roots.setdefault(operation['root'], [[], []])[0].append(operation)
+        for counter in summary['counters']:
+            roots.setdefault(counter['root'], [[], []])[1].append(counter)
 
-        self.path = None
-        normal_path = root_drive + possible_dirs[0] + path_suffix
-        raise NotFoundError('Unable to find ' + self.__class__.__name__ +
-                            '.\n\nPlease add the path to ' + binary_name +
-                            ' to the setting "' + setting_name + '" in "' +
-                            sublime.packages_path() +
-                            '\\Tortoise\\Tortoise.sublime-settings".\n\n' +
-                            'Example:\n\n' + '{"' + setting_name + '": r"' +
-                            normal_path + '"}')
+        for root_dir in sorted(roots.keys()):
+            operations, counters = roots[root_dir]
+            lines.extend(['', root_dir or '(no working copy)'])
+            if operations:
+                lines.append('  %-32s %7s %9s %9s %9s %9s' % ('operation',
+                    'count', 'p50 ms', 'p95 ms', 'max ms', 'KB read'))
+            for operation in operations:
+                lines.append('  %-32s %7d %9.1f %9.1f %9.1f %9.1f' % (
+                    operation['operation'], operation['count'],
+                    operation['p50'] * 1000, operation['p95'] * 1000,
+                    operation['max'] * 1000, operation['bytes'] / 1024.0))
+            for counter in counters:
+                lines.append('  %-32s %7d' % (counter['name'],
+                    counter['count']))
 
-    def explore(self, path=None):
-        if path == None:
-            ForkGui('explorer.exe "' + self.root_dir + '"', None)
-        else:
-            ForkGui('explorer.exe "' + os.path.dirname(path) + '"', None)
+        return '\n'.join(lines) + '\n'
 
-    def process_status(self, vcs, path):
-        global file_status_cache
-        settings = sublime.load_settings('Tortoise.sublime-settings')
-        if path in file_status_cache and file_status_cache[path]['time'] > \
-                time.time() - settings.get('cache_length'):
-            if settings.get('debug'):
-                print 'Fetching cached status for %s' % path
-            return file_status_cache[path]['status']
 
-        if settings.get('debug'):
-            start_time = time.time()
+# Lists the changed files of every working copy in the window's folders,
+# from the cached status snapshots where possible. With output "view" the
+# list is shown in a scratch view that is updated whenever a snapshot is
+# refreshed, otherwise in a quick panel once all working copies are listed.
+class TortoiseChangedFilesCommand(sublime_plugin.WindowCommand,
+        TortoiseCommand):
+    def run(self, output='panel'):
+        vcses = {}
+        for folder in self.window.folders():
+            try:
+                vcs = self.get_vcs(folder)
+            except (NotFoundError):
+                continue
+            vcses.setdefault(vcs.root_dir, vcs)
+        if not vcses:
+            sublime.status_message('No working copies in the open folders')
+            return
 
-        try:
-            status = vcs.check_status(path)
-        except (Exception) as (exception):
-            sublime.error_message(str(exception))
+        if output == 'view':
+            view = self.window.new_file()
+            view.set_scratch(True)
+            view.set_read_only(True)
+            view.set_name('Tortoise Changed Files')
+            view.settings().set('result_file_regex', '^  \\S+  (.+)$')
+            state = ChangedFiles(vcses.values(), view)
+            changed_files[view.id()] = state
+        else:
+            state = ChangedFiles(vcses.values(), None)
+            state.window = self.window
+            changed_files[('panel', self.window.id())] = state
+        state.refresh(0)
 
-        file_status_cache[path] = {
-            'time': time.time() + settings.get('cache_length'),
-            'status': status
-        }
 
-        if settings.get('debug'):
-            print 'Fetching status for %s in %s seconds' % (path,
-                str(time.time() - start_time))
+class TortoiseChangedFilesListener(sublime_plugin.EventListener):
+    def on_activated(self, view):
+        state = changed_files.get(view.id())
+        if state != None:
+            state.refresh(1)
 
-        return status
+    def on_close(self, view):
+        changed_files.pop(view.id(), None)
 
 
-class TortoiseProc(Tortoise):
-    def status(self, path=None):
-        path = self.root_dir if path == None else path
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:repostatus /path:"%s"' % path,
-            self.root_dir)
+class TortoiseStatusListener(sublime_plugin.EventListener, TortoiseCommand):
+    prefetched_windows = set()
 
-    def commit(self, path=None):
-        path = self.root_dir if path == None else path
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:commit /path:"%s"' % path,
-            self.root_dir)
+    def on_load(self, view):
+        self.invalidate(view.file_name(), True)
+        self.prefetch([view.file_name()])
 
-    def log(self, path=None):
-        path = self.root_dir if path == None else path
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:log /path:"%s"' % path,
-            self.root_dir)
+    def on_activated(self, view):
+        window = view.window()
+        if window != None and window.id() not in self.prefetched_windows:
+            self.prefetched_windows.add(window.id())
+            self.prefetch_window(window)
+        self.prefetch([view.file_name()])
 
-    def blame(self, path=None):
-        path = self.root_dir if path == None else path
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:blame /path:"%s"' % path,
-            self.root_dir)
+    def on_post_save(self, view):
+        self.invalidate(view.file_name())
 
-    def diff(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:diff /path:"%s"' % path,
-            self.root_dir)
+    # Loading a file only invalidates the cache if the file was changed
+    # outside of Sublime after its status was fetched
+    def invalidate(self, path, only_if_changed=False):
+        if not path:
+            return
+        try:
+            vcs = self.get_vcs(path)
+        except (NotFoundError):
+            return
 
-    def add(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:add /path:"%s"' % path,
-            self.root_dir)
+        # The file's status may be cached on its own, e.g. from the native
+        # reader, as well as in the snapshot
+        if only_if_changed:
+            try:
+                mtime = os.path.getmtime(path)
+            except (OSError):
+                return
+            stale = False
+            for key in [vcs.snapshot_key(), (vcs.root_dir, path)]:
+                fetched = status_cache.get_time(key)
+                if fetched != None and mtime >= fetched:
+                    stale = True
+            if not stale:
+                return
 
-    def remove(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:remove /path:"%s"' % path,
-            self.root_dir)
+        status_cache.invalidate_root(vcs.root_dir)
+        status_memo.clear()
+        vcs.get_status(path, False)
 
-    def revert(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:revert /path:"%s"' % path,
-            self.root_dir)
+    # Statuses for the open files and the folders shown in the side bar,
+    # which are the ones the menus will ask for first
+    def prefetch_window(self, window):
+        paths = [view.file_name() for view in window.views()]
+        for folder in window.folders():
+            paths.append(folder)
+            try:
+                names = sorted(os.listdir(folder))[:50]
+            except (OSError):
+                continue
+            for name in names:
+                path = os.path.join(folder, name)
+                if not name.startswith('.') and os.path.isdir(path):
+                    paths.append(path)
+        self.prefetch(paths)
 
+    def prefetch(self, paths):
+        settings = sublime.load_settings('Tortoise.sublime-settings')
+        if not settings.get('prefetch_status', True):
+            return
 
-class TortoiseSVN(TortoiseProc):
-    def __init__(self, binary_path, file):
-        self.find_root('.svn', file, False)
-        if binary_path != None:
-            self.path = binary_path
-        else:
-            self.set_binary_path('TortoiseSVN\\bin\\TortoiseProc.exe',
-                'TortoiseProc.exe', 'svn_tortoiseproc_path')
+        roots = {}
+        for path in paths:
+            if not path:
+                continue
+            try:
+                vcs = self.get_vcs(path)
+            except (NotFoundError):
+                continue
+            roots.setdefault(vcs.root_dir, (vcs, []))[1].append(path)
+        for vcs, root_paths in roots.values():
+            vcs.prefetch(root_paths)
 
-    def sync(self, path=None):
-        path = self.root_dir if path == None else path
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:update /path:"%s"' % path,
-            self.root_dir)
 
-    def get_status(self, path):
-        svn = SVN(self.root_dir)
-        return self.process_status(svn, path)
+# Marks the lines changed since the base revision in the gutter and sums
+# them up in the status bar. Edits are diffed on the status worker once
+# typing pauses.
+class TortoiseChangesListener(sublime_plugin.EventListener, TortoiseCommand):
+    def on_load(self, view):
+        self.schedule(view)
 
+    def on_activated(self, view):
+        self.schedule(view)
 
-class TortoiseGit(TortoiseProc):
-    def __init__(self, binary_path, file):
-        self.find_root('.git', file)
-        if binary_path != None:
-            self.path = binary_path
-        else:
-            self.set_binary_path('TortoiseGit\\bin\\TortoiseProc.exe',
-                'TortoiseProc.exe', 'git_tortoiseproc_path')
+    def on_modified(self, view):
+        self.schedule(view)
 
-    def sync(self, path=None):
-        path = self.root_dir if path == None else path
-        path = os.path.relpath(path, self.root_dir)
-        ForkGui('"' + self.path + '" /command:sync /path:"%s"' % path,
-            self.root_dir)
+    def on_post_save(self, view):
+        self.schedule(view)
 
-    def get_status(self, path):
-        git = Git(self.path, self.root_dir)
-        return self.process_status(git, path)
+    def on_close(self, view):
+        view_changes.pop(view.id(), None)
 
+    def schedule(self, view):
+        settings = sublime.load_settings('Tortoise.sublime-settings')
+        if not view.file_name() or not settings.get('change_indicators',
+                True):
+            return
+        changes = view_changes.setdefault(view.id(), ViewChanges())
+        changes.generation += 1
+        generation = changes.generation
+        sublime.set_timeout(lambda: self.update(view, generation),
+            settings.get('change_indicators_delay', 300))
 
-class TortoiseHg(Tortoise):
-    def __init__(self, binary_path, file):
-        self.find_root('.hg', file)
-        if binary_path != None:
-            self.path = binary_path
-        else:
+    def update(self, view, generation):
+        changes = view_changes.get(view.id())
+        if changes == None or changes.generation != generation:
+            return
+        path = view.file_name()
+        try:
+            vcs = self.get_vcs(path)
+        except (NotFoundError):
+            self.show(view, [], [], [], 0)
+            return
+        status = self.get_status(vcs, path)
+        if status in ['?', 'I']:
+            self.show(view, [], [], [], 0)
+            return
+        changes.text = view.substr(sublime.Region(0, view.size()))
+        status_worker.add((vcs.root_dir, 'changes', view.id()), 0,
+            self.diff, view, changes, vcs, path, status)
+
+    # Called from the status worker thread
+    def diff(self, view, changes, vcs, path, status):
+        signature = vcs.get_index_signature()
+        if changes.diff == None or changes.path != path or \
+                changes.signature != signature:
             try:
-                self.set_binary_path('TortoiseHg\\thgw.exe',
-                    'thgw.exe', 'hg_hgtk_path')
-            except (NotFoundError):
-                self.set_binary_path('TortoiseHg\\hgtk.exe',
-                    'thgw.exe (for TortoiseHg v2.x) or hgtk.exe (for ' +
-                    'TortoiseHg v1.x)', 'hg_hgtk_path')
+                contents = vcs.get_backend().get_base_contents(path)
+            except (Exception):
+                contents = None
+            if contents == None and status != 'A':
+                changes.diff = None
+                sublime.set_timeout(lambda: self.show(view, [], [], [], 0),
+                    0)
+                return
+            changes.diff = LineDiff(split_lines(contents or ''))
+            changes.path = path
+            changes.signature = signature
 
-    def status(self, path=None):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'status', '--nofork', path]
-        ForkGui(args, self.root_dir)
+        changes.diff.update(changes.text.split('\n'))
+        result = changes.diff.get_changes()
+        sublime.set_timeout(lambda: self.show(view, *result), 0)
 
-    def commit(self, path=None):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'commit', '--nofork', path]
-        ForkGui(args, self.root_dir)
+    def show(self, view, added, modified, deleted, deleted_count):
+        last_row = view.rowcol(view.size())[0]
 
-    def sync(self, path=None):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'synch', '--nofork', path]
-        ForkGui(args, self.root_dir)
+        def get_regions(rows):
+            return [view.line(view.text_point(min(row, last_row), 0))
+                for row in rows]
 
-    def log(self, path=None):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'log', '--nofork', path]
-        ForkGui(args, self.root_dir)
+        flags = sublime.HIDDEN | sublime.PERSISTENT
+        view.add_regions('tortoise_added', get_regions(added),
+            'markup.inserted', 'dot', flags)
+        view.add_regions('tortoise_modified', get_regions(modified),
+            'markup.changed', 'dot', flags)
+        view.add_regions('tortoise_deleted', get_regions(deleted),
+            'markup.deleted', 'bookmark', flags)
 
-    def blame(self, path=None):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'blame', '--nofork', path]
-        ForkGui(args, self.root_dir)
+        if added or modified or deleted:
+            view.set_status('tortoise_changes', '+%d ~%d -%d lines' % (
+                len(added), len(modified), deleted_count))
+        else:
+            view.erase_status('tortoise_changes')
 
-    def diff(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'vdiff', '--nofork', path]
-        ForkGui(args, self.root_dir)
 
-    def add(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'add', '--nofork', path]
-        ForkGui(args, self.root_dir)
+# Keeps inline blames up to date. The lines on screen are blamed first, if
+# the VCS can, then the whole file on the history worker at a lower
+# priority. Blames are cached per revision, and edits are mapped onto the
+# blamed lines with a LineDiff instead of blaming again.
+class TortoiseBlameListener(sublime_plugin.EventListener, TortoiseCommand):
+    def on_activated(self, view):
+        if view.id() in view_blames:
+            self.start(view)
 
-    def remove(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'remove', '--nofork', path]
-        ForkGui(args, self.root_dir)
+    def on_post_save(self, view):
+        if view.id() in view_blames:
+            self.start(view)
 
-    def revert(self, path):
-        path = os.path.relpath(path, self.root_dir)
-        args = [self.path, 'revert', '--nofork', path]
-        ForkGui(args, self.root_dir)
+    def on_modified(self, view):
+        state = view_blames.get(view.id())
+        if state == None:
+            return
+        state.generation += 1
+        generation = state.generation
+        settings = sublime.load_settings('Tortoise.sublime-settings')
+        sublime.set_timeout(lambda: self.remap(view, generation),
+            settings.get('blame_delay', 300))
 
-    def get_status(self, path):
-        hg = Hg(self.path, self.root_dir)
-        return self.process_status(hg, path)
+    def on_selection_modified(self, view):
+        if view.id() in view_blames:
+            self.show(view)
 
+    def on_close(self, view):
+        source = blame_panels.get(view.id())
+        if source != None:
+            close_blame(source)
+        elif view.id() in view_blames:
+            close_blame(view)
 
-class NonInteractiveProcess():
-    def __init__(self, args, cwd=None):
-        self.args = args
-        self.cwd  = cwd
+    def start(self, view):
+        state = view_blames.get(view.id())
+        path = view.file_name()
+        try:
+            vcs = self.get_vcs(path)
+        except (NotFoundError):
+            return
+        visible = view.visible_region()
+        first = view.rowcol(visible.begin())[0]
+        last = view.rowcol(visible.end())[0]
+        state.text = view.substr(sublime.Region(0, view.size()))
+        history_worker.add((vcs.root_dir, 'blame', view.id()), 0, self.load,
+            view, state, vcs, path, first, last)
+
+    # Called from the history worker thread
+    def load(self, view, state, vcs, path, first, last):
+        backend = vcs.get_backend()
+        revision = backend.get_blame_revision(path)
+        key = (vcs.root_dir, path, revision)
+        blame = None
+        if revision != None:
+            blame = blame_cache.get(key)
+        if blame != None and blame.complete:
+            self.set_blame(view, state, blame)
+            return
+
+        blame = Blame()
+        state.blame = blame
+        state.diff = None
+        if isinstance(backend, Git):
+            try:
+                for line, contents, info in backend.annotate(path, first,
+                        last + 1):
+                    blame.lines[line] = (contents, info)
+            except (OSError):
+                pass
+            sublime.set_timeout(lambda: self.update(view), 0)
+        history_worker.add((vcs.root_dir, 'blame all', view.id()), 1,
+            self.load_all, view, state, backend, path, key, blame)
+
+    def load_all(self, view, state, backend, path, key, blame):
+        try:
+            for line, contents, info in backend.annotate(path):
+                blame.lines[line] = (contents, info)
+        except (OSError, ValueError, KeyError):
+            pass
+        blame.complete = True
+        if key[2] != None:
+            blame_cache.set(key, blame, len(blame.lines))
+        self.set_blame(view, state, blame)
+
+    def set_blame(self, view, state, blame):
+        lines = [blame.lines[line][0] for line in sorted(blame.lines)]
+        diff = LineDiff(split_lines('\n'.join(lines)))
+        diff.update(state.text.split('\n'))
+        state.blame = blame
+        state.diff = diff
+        sublime.set_timeout(lambda: self.update(view), 0)
+
+    def remap(self, view, generation):
+        state = view_blames.get(view.id())
+        if state == None or state.generation != generation:
+            return
+        state.text = view.substr(sublime.Region(0, view.size()))
+        if state.diff == None:
+            return
+        history_worker.add((None, 'blame remap', view.id()), 0,
+            self.update_diff, view, state)
+
+    def update_diff(self, view, state):
+        state.diff.update(state.text.split('\n'))
+        sublime.set_timeout(lambda: self.update(view), 0)
+
+    # The blame info of a row of the view, or a message if there is none
+    def get_info(self, state, row):
+        line = row
+        if state.diff != None:
+            line = state.diff.get_base_line(row)
+        if line in state.blame.lines:
+            return state.blame.lines[line][1]
+        if line == None or state.blame.complete:
+            return 'not committed yet'
+        return 'loading...'
+
+    def update(self, view):
+        self.show(view)
+        state = view_blames.get(view.id())
+        if state == None or state.blame == None or state.panel == None:
+            return
+
+        lines = []
+        for row in range(view.rowcol(view.size())[0] + 1):
+            info = self.get_info(state, row)
+            if isinstance(info, dict):
+                lines.append('%s %-12s %s' % (info['revision'],
+                    info['author'][0:12], info['date']))
+            elif info == 'loading...':
+                lines.append(info)
+            else:
+                lines.append('')
+
+        panel = state.panel
+        panel.set_read_only(False)
+        edit = panel.begin_edit()
+        panel.replace(edit, sublime.Region(0, panel.size()),
+            '\n'.join(lines))
+        panel.end_edit(edit)
+        panel.set_read_only(True)
+        state.position = None
+
+    def show(self, view):
+        state = view_blames.get(view.id())
+        if state == None or state.blame == None or not view.sel():
+            return
+        info = self.get_info(state, view.rowcol(view.sel()[0].begin())[0])
+        if isinstance(info, dict):
+            info = '%s %s %s %s' % (info['revision'], info['author'],
+                info['date'], info['summary'])
+        view.set_status('tortoise_blame', ('Blame: ' + info).rstrip())
+
+    # Sublime Text 2 has no scroll event, so the panel follows the view with
+    # a timer for as long as state is the view's blame
+    def sync(self, view, state):
+        if view_blames.get(view.id()) is not state:
+            return
+        position = view.viewport_position()
+        if position != state.position:
+            state.panel.set_viewport_position((0, position[1]), False)
+            state.position = position
+        sublime.set_timeout(lambda: self.sync(view, state), 100)
+
+
+# Turns the blame of view off and closes its panel, restoring the layout if
+# the panel needed a group of its own
+def close_blame(view):
+    state = view_blames.pop(view.id(), None)
+    if state == None:
+        return
+    view.erase_status('tortoise_blame')
+    blame_panels.pop(state.panel.id(), None)
+    window = state.panel.window() or view.window()
+    if window == None:
+        return
+    if state.panel.window() != None:
+        window.focus_view(state.panel)
+        window.run_command('close_file')
+    if state.layout_changed and window.num_groups() == 2 and \
+            not window.views_in_group(1):
+        window.run_command('set_layout', {'cols': [0.0, 1.0],
+            'rows': [0.0, 1.0], 'cells': [[0, 0, 1, 1]]})
+    if view.window() != None:
+        window.focus_view(view)
+
+
+class ForkGui():
+    def __init__(self, cmd, cwd):
+        subprocess.Popen(cmd, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            cwd=cwd)
+
+
+# Finds a command line client, preferring the candidates, such as the client
+# installed with the Tortoise GUI, over the one on the PATH. Each client is
+# only looked for once. If it isn't found the bare name is used, so running
+# it fails like any other missing executable.
+def find_client(name, candidates):
+    key = (name,) + tuple(candidates)
+    if key not in binary_path_cache:
+        start_time = time.time()
+        executable = name + '.exe' if os.name == 'nt' else name
+        paths = list(candidates)
+        for dir in os.environ.get('PATH', '').split(os.pathsep):
+            if dir:
+                paths.append(os.path.join(dir.strip('"'), executable))
+        binary_path_cache[key] = name
+        for path in paths:
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                binary_path_cache[key] = path
+                break
+        metrics.record('find client', None, time.time() - start_time)
+    return binary_path_cache[key]
+
+
+# JSON only holds unicode, while paths are byte strings in whatever encoding
+# the file system uses. latin-1 maps every byte to a character, so any path
+# survives the round trip.
+def encode_cache_path(path):
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return path.decode('latin-1')
+
+
+class Tortoise():
+    # The GUIs are only installed under Program Files on Windows
+    def find_binary_path(self, path_suffix):
+        if os.name != 'nt':
+            return None
+
+        root_drive = os.path.expandvars('%HOMEDRIVE%\\')
+
+        possible_dirs = [
+            'Program Files\\',
+            'Program Files (x86)\\'
+        ]
+
+        if path_suffix not in binary_path_cache:
+            start_time = time.time()
+            binary_path_cache[path_suffix] = None
+            for dir in possible_dirs:
+                path = root_drive + dir + path_suffix
+                if os.path.exists(path):
+                    binary_path_cache[path_suffix] = path
+                    break
+            metrics.record('set_binary_path', None, time.time() - start_time)
+        return binary_path_cache[path_suffix]
+
+    def set_binary_path(self, path_suffix, binary_name, setting_name):
+        self.path = self.find_binary_path(path_suffix)
+        if self.path != None:
+            return
+
+        normal_path = os.path.expandvars('%HOMEDRIVE%\\') + \
+            'Program Files\\' + path_suffix
+        raise NotFoundError('Unable to find ' + self.__class__.__name__ +
+                            '.\n\nPlease add the path to ' + binary_name +
+                            ' to the setting "' + setting_name + '" in "' +
+                            sublime.packages_path() +
+                            '\\Tortoise\\Tortoise.sublime-settings".\n\n' +
+                            'Example:\n\n' + '{"' + setting_name + '": r"' +
+                            normal_path + '"}')
+
+    def explore(self, path=None):
+        dir = self.root_dir if path == None else os.path.dirname(path)
+        if os.name == 'nt':
+            ForkGui('explorer.exe "' + dir + '"', None)
+        elif sys.platform == 'darwin':
+            ForkGui(['open', dir], None)
+        else:
+            ForkGui(['xdg-open', dir], None)
+
+    # The command line clients installed alongside the GUI, e.g. tgit.exe
+    # next to TortoiseGit's TortoiseProc.exe
+    def find_bundled_clients(self, path_suffixes, client_name):
+        paths = [self.path]
+        if self.path == None:
+            paths = [self.find_binary_path(suffix) for suffix in
+                path_suffixes]
+        return [os.path.join(os.path.dirname(path), client_name)
+            for path in paths if path != None]
+
+    def get_status(self, path, blocking=True):
+        return self.process_status(self.get_backend(), path, blocking)
+
+    # Answers what it can from the cache and the native readers, and
+    # queues the rest for the worker. Unknown statuses are None.
+    def get_statuses(self, paths):
+        start_time = time.time()
+        vcs = self.get_backend()
+        options = self.get_status_options()
+        statuses = []
+        missing = []
+        for path in paths:
+            status = self.get_cached_status(path, options['cache_length'])
+            if status == None:
+                status = self.fetch_native_status(vcs, path, options, False)
+            if status == None:
+                missing.append(path)
+            statuses.append(status)
+        if missing:
+            status_worker.prefetch(self, vcs, missing, options, 0)
+        metrics.record('status lookup', self.root_dir,
+            time.time() - start_time)
+        return statuses
+
+    # Reads the settings the status code needs, since the worker thread
+    # can't use the sublime API
+    def get_status_options(self):
+        settings = sublime.load_settings('Tortoise.sublime-settings')
+        return {
+            'debug': settings.get('debug'),
+            'cache_length': settings.get('cache_length'),
+            'native_status': settings.get('native_status', True),
+            'cache_dir': get_cache_dir(settings)
+        }
+
+    def process_status(self, vcs, path, blocking=True):
+        start_time = time.time()
+        options = self.get_status_options()
+        status = self.get_cached_status(path, options['cache_length'])
+        if status != None:
+            if options['debug']:
+                print 'Fetching cached status for %s' % path
+
+        elif not blocking:
+            # Reading the status natively is cheap once the index has been
+            # loaded, so only loading the index is left to the worker
+            status = self.fetch_native_status(vcs, path, options, False)
+            if status == None:
+                status_worker.prefetch(self, vcs, [path], options, 0)
+
+        else:
+            status = self.fetch_status(vcs, path, options)
+
+        metrics.record('status lookup', self.root_dir,
+            time.time() - start_time)
+        return status
+
+    def prefetch(self, paths):
+        if process_guard.is_large(self.root_dir):
+            return
+        status_worker.prefetch(self, self.get_backend(), paths,
+            self.get_status_options())
+
+    def snapshot_key(self):
+        return (self.root_dir, None)
+
+    def get_cached_status(self, path, cache_length):
+        start_time = time.time()
+        signature = self.get_index_signature()
+        snapshot = status_cache.get(self.snapshot_key(), cache_length,
+            signature)
+        if snapshot != None:
+            status = snapshot.get_status(path)
+        else:
+            status = status_cache.get((self.root_dir, path), cache_length,
+                signature)
+        metrics.record('cache lookup', self.root_dir,
+            time.time() - start_time)
+        metrics.count('cache hit' if status != None else 'cache miss',
+            self.root_dir)
+        return status
+
+    # The files the VCS rewrites whenever the working copy state changes
+    # through it, e.g. on add, commit, revert or update
+    def get_index_signature(self):
+        signature = []
+        for path in self.get_index_files():
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime, stat.st_size))
+            except (OSError):
+                signature.append(None)
+        return signature
+
+    # Called from the status worker thread, so it must not use the sublime
+    # API other than sublime.set_timeout()
+    def fetch_status(self, vcs, path, options):
+        start_time = time.time()
+
+        status = self.fetch_native_status(vcs, path, options)
+        if status == None and not process_guard.is_large(self.root_dir):
+            snapshot = self.fetch_snapshot(vcs, options)
+            if snapshot != None:
+                status = snapshot.get_status(path)
+        # Fetching the snapshot may have switched to large repository mode
+        if status == None and process_guard.is_large(self.root_dir):
+            status = self.fetch_scoped_status(vcs, path)
+
+        elapsed = time.time() - start_time
+        metrics.record('fetch status', self.root_dir, elapsed)
+        if options.get('debug'):
+            print 'Fetching status for %s in %s seconds' % (path,
+                str(elapsed))
+
+        return status
+
+    # In large repository mode only path itself is looked at, and folders
+    # leave out untracked files
+    def fetch_scoped_status(self, vcs, path):
+        start_time = time.time()
+        try:
+            if os.path.isdir(path):
+                status = vcs.check_directory_status(path)
+            else:
+                status = vcs.check_status(path)
+        except (ProcessTimeoutError, ProcessBlockedError):
+            return None
+        except (OSError) as (exception):
+            show_error(str(exception))
+            return None
+        status_cache.set((self.root_dir, path), status,
+            signature=self.get_index_signature())
+        metrics.record('scoped status', self.root_dir,
+            time.time() - start_time)
+        return status
+
+    # Called from the status worker thread. In large repository mode, or if
+    # listing the working copy times out, only the changes are listed,
+    # without unversioned files.
+    def fetch_changes(self, vcs, options):
+        snapshot = None
+        if not process_guard.is_large(self.root_dir):
+            snapshot = self.fetch_snapshot(vcs, options)
+        if snapshot == None:
+            try:
+                statuses = vcs.check_changes(self.root_dir)
+            except (OSError):
+                statuses = {}
+            snapshot = StatusSnapshot(self.root_dir, statuses)
+        # The snapshot may have been fetched for someone else before the
+        # changed files were being shown, so it is reported again
+        report_changes(self.root_dir, list_changes(snapshot))
+
+    # The first snapshot of a working copy comes from the cache file written
+    # during the last session, if the index hasn't changed since. It is
+    # refreshed in the background to pick up edits made in the meantime.
+    # None if listing the working copy timed out.
+    def fetch_snapshot(self, vcs, options):
+        cache_dir = options.get('cache_dir')
+        if cache_dir and self.root_dir not in restored_roots:
+            restored_roots.add(self.root_dir)
+            snapshot = self.restore_snapshot(cache_dir)
+            if snapshot != None:
+                status_worker.add((self.root_dir, 'refresh'), 1,
+                    self.fetch_snapshot, vcs, options)
+                return snapshot
+        restored_roots.add(self.root_dir)
+
+        start_time = time.time()
+        try:
+            statuses = vcs.check_root_status()
+        except (ProcessBlockedError):
+            return None
+        except (ProcessTimeoutError):
+            process_guard.set_large(self.root_dir)
+            return None
+        except (Exception) as (exception):
+            show_error(str(exception))
+            statuses = {}
+        snapshot = StatusSnapshot(self.root_dir, statuses)
+        elapsed = time.time() - start_time
+        metrics.record('fetch snapshot', self.root_dir, elapsed)
+        process_guard.measure(self.root_dir, elapsed, len(statuses))
+        signature = self.get_index_signature()
+        status_cache.set(self.snapshot_key(), snapshot,
+            len(snapshot.statuses), signature)
+        report_snapshot(snapshot)
+        if cache_dir:
+            status_worker.add((self.root_dir, 'persist'), 2,
+                self.persist_snapshot, snapshot, signature, cache_dir)
+        return snapshot
+
+    def get_cache_file(self, cache_dir):
+        name = hashlib.sha1(os.path.normcase(self.root_dir)).hexdigest()
+        return os.path.join(cache_dir, name + '.cache')
+
+    # Cache files are zlib compressed JSON, with the paths grouped by status
+    def persist_snapshot(self, snapshot, signature, cache_dir):
+        groups = {}
+        for path, status in snapshot.statuses.items():
+            groups.setdefault(status, []).append(encode_cache_path(path))
+        data = zlib.compress(json.dumps({
+            'encoding': 'latin-1',
+            'root': encode_cache_path(self.root_dir),
+            'signature': signature,
+            'statuses': groups
+        }))
+
+        path = self.get_cache_file(cache_dir)
+        temp_path = path + '.tmp'
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            f = open(temp_path, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            # Windows won't rename over an existing file
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+
+    def restore_snapshot(self, cache_dir):
+        start_time = time.time()
+        try:
+            data = json.loads(zlib.decompress(read_file(
+                self.get_cache_file(cache_dir))))
+        except (IOError, OSError, ValueError, zlib.error):
+            return None
+
+        # JSON turns tuples into lists and strings into unicode
+        signature = self.get_index_signature()
+        expected = json.loads(json.dumps(['latin-1',
+            encode_cache_path(self.root_dir), signature]))
+        if [data.get('encoding'), data.get('root'),
+                data.get('signature')] != expected:
+            return None
+
+        statuses = {}
+        for status, paths in data['statuses'].items():
+            paths = [path.encode('latin-1') for path in paths]
+            statuses.update(dict.fromkeys(paths, str(status)))
+        snapshot = StatusSnapshot(self.root_dir, statuses)
+        status_cache.set(self.snapshot_key(), snapshot,
+            len(snapshot.statuses), signature)
+        report_snapshot(snapshot)
+        metrics.record('restore snapshot', self.root_dir,
+            time.time() - start_time)
+        return snapshot
+
+    # Caches the statuses of paths that menus are waiting for or will
+    # likely ask for soon. The snapshot is only fetched for folders and files
+    # the native reader couldn't answer.
+    def prefetch_status(self, vcs, paths, options):
+        if options.get('debug'):
+            print 'Prefetching %s statuses in %s' % (len(paths), self.root_dir)
+
+        need_snapshot = False
+        for path in paths:
+            if self.get_cached_status(path, options['cache_length']) != None:
+                continue
+            if self.fetch_native_status(vcs, path, options) != None:
+                continue
+            if process_guard.is_large(self.root_dir):
+                self.fetch_status(vcs, path, options)
+            else:
+                need_snapshot = True
+
+        if need_snapshot and status_cache.get(self.snapshot_key(),
+                options['cache_length'], self.get_index_signature()) == None:
+            self.fetch_snapshot(vcs, options)
+
+    def fetch_native_status(self, vcs, path, options, load=True):
+        if not options.get('native_status') or os.path.isdir(path):
+            return None
+        start_time = time.time()
+        status = vcs.check_native_status(path, load)
+        if status != None:
+            status_cache.set((self.root_dir, path), status,
+                signature=self.get_index_signature())
+        metrics.record('native status', self.root_dir,
+            time.time() - start_time)
+        return status
+
+    # The history of path fetched so far, which is kept until the working
+    # copy's index changes
+    def get_log_history(self, path):
+        key = (self.root_dir, path)
+        signature = self.get_index_signature()
+        history = log_cache.get(key, signature)
+        if history == None:
+            history = LogHistory(path)
+            log_cache.set(key, history, 1, signature)
+        return history
+
+    # Called from the history worker thread. Reads the next page of history,
+    # then calls callback, if any, on the UI thread.
+    def load_log_page(self, history, page_size, callback=None):
+        if not history.complete:
+            start_time = time.time()
+            try:
+                entries = self.get_backend().get_log(history.path,
+                    history.entries, page_size)
+            except (OSError) as (exception):
+                show_error(str(exception))
+                entries = []
+            metrics.record('log page', self.root_dir,
+                time.time() - start_time)
+            history.entries.extend(entries)
+            history.complete = len(entries) < page_size
+            log_cache.set((self.root_dir, history.path), history,
+                len(history.entries), self.get_index_signature())
+        if callback != None:
+            sublime.set_timeout(callback, 0)
+
+    # Called from the history worker thread
+    def load_log_revision(self, window, path, entry):
+        try:
+            text = self.get_backend().show_revision(path, entry)
+        except (OSError) as (exception):
+            show_error(str(exception))
+            return
+
+        def show():
+            view = window.new_file()
+            view.set_scratch(True)
+            view.set_name('%s %s' % (entry['revision'], entry['summary']))
+            view.set_syntax_file('Packages/Diff/Diff.tmLanguage')
+            edit = view.begin_edit()
+            view.insert(edit, 0, text)
+            view.end_edit(edit)
+        sublime.set_timeout(show, 0)
+
+
+class LRUCacheEntry():
+    def __init__(self, key, value, weight, signature=None):
+        self.key = key
+        self.value = value
+        self.weight = max(weight, 1)
+        self.signature = signature
+        self.time = time.time()
+        self.prev = None
+        self.next = None
+
+
+# Keeps weighted values, evicting the least recently used ones once the
+# total weight passes max_size. Entries expire when the signature passed to
+# get() differs from the one they were stored with. It is shared between the
+# UI thread and the status worker.
+class LRUCache():
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.head = LRUCacheEntry(None, None, 0)
+        self.head.prev = self.head
+        self.head.next = self.head
+
+    def get(self, key, signature=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry.signature != signature:
+                self.remove(key)
+                entry = None
+            if entry == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.unlink(entry)
+            self.link(entry)
+            return entry.value
+
+    def get_time(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry.time if entry != None else None
+
+    def set(self, key, value, weight=1, signature=None):
+        with self.lock:
+            self.remove(key)
+            entry = LRUCacheEntry(key, value, weight, signature)
+            self.entries[key] = entry
+            self.size += entry.weight
+            self.link(entry)
+
+            # The newest entry is always kept, even if it is too big
+            while self.size > self.max_size and \
+                    self.head.prev is not entry:
+                self.remove(self.head.prev.key)
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry == None:
+                return
+            self.unlink(entry)
+            self.size -= entry.weight
+
+    def clear(self):
+        with self.lock:
+            for key in self.entries.keys():
+                self.remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def link(self, entry):
+        entry.prev = self.head
+        entry.next = self.head.next
+        self.head.next.prev = entry
+        self.head.next = entry
+
+    def unlink(self, entry):
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = None
+        entry.next = None
+
+
+# Holds directory statuses and per-root snapshots keyed by (root_dir, path),
+# where path is None for a snapshot. Besides the signature, entries expire
+# after the TTL passed to get(), unless it is None. A snapshot weighs as
+# much as the number of paths in it, so max_size is the number of statuses
+# kept.
+class StatusCache(LRUCache):
+    def __init__(self, max_size=50000):
+        LRUCache.__init__(self, max_size)
+        self.roots = {}
+
+    def get(self, key, ttl, signature=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and ttl != None and \
+                    entry.time <= time.time() - ttl:
+                self.remove(key)
+            return LRUCache.get(self, key, signature)
+
+    def set(self, key, value, weight=1, signature=None):
+        with self.lock:
+            LRUCache.set(self, key, value, weight, signature)
+            self.roots.setdefault(key[0], set()).add(key)
+
+    def remove(self, key):
+        with self.lock:
+            LRUCache.remove(self, key)
+            keys = self.roots.get(key[0])
+            if keys != None:
+                keys.discard(key)
+                if not keys:
+                    del self.roots[key[0]]
+
+    def invalidate_root(self, root_dir):
+        with self.lock:
+            for key in list(self.roots.get(root_dir, [])):
+                self.remove(key)
+
+
+status_cache = StatusCache()
+# Blames of files keyed by (root_dir, path, revision), weighted by lines
+blame_cache = LRUCache(200000)
+# LogHistory of files and folders keyed by (root_dir, path), weighted by
+# entries
+log_cache = LRUCache(100000)
+
+
+# Rendering a menu asks every command whether it is visible and enabled,
+# and they all look at the same paths, so statuses are remembered for a
+# moment rather than looked up again by each command
+class StatusMemo():
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry == None or entry[0] < time.time() - self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, path, status):
+        if len(self.entries) > 1000:
+            self.entries.clear()
+        self.entries[path] = (time.time(), status)
+
+    def clear(self):
+        self.entries.clear()
+
+
+status_memo = StatusMemo(0.5)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+# Timings of the most recent operations, such as processes, cache lookups
+# and working copy searches, kept for the performance report. Each record
+# is (operation, root_dir, seconds, bytes read).
+class Metrics():
+    def __init__(self, size):
+        self.records = collections.deque(maxlen=size)
+        self.counters = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, operation, root_dir, duration, size=0):
+        with self.lock:
+            self.records.append((operation, root_dir, duration, size))
+
+    def count(self, name, root_dir):
+        with self.lock:
+            key = (name, root_dir)
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.counters.clear()
+            self.started = time.time()
+
+    def summarize(self):
+        with self.lock:
+            records = list(self.records)
+            counters = self.counters.items()
+
+        groups = {}
+        for operation, root_dir, duration, size in records:
+            group = groups.setdefault((root_dir, operation), [[], 0])
+            group[0].append(duration)
+            group[1] += size
+
+        operations = []
+        for (root_dir, operation), (durations, size) in sorted(
+                groups.items()):
+            operations.append({
+                'root': root_dir,
+                'operation': operation,
+                'count': len(durations),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'max': max(durations),
+                'bytes': size
+            })
+
+        return {
+            'started': self.started,
+            'records': len(records),
+            'operations': operations,
+            'counters': [{'root': root_dir, 'name': name, 'count': count}
+                for (name, root_dir), count in sorted(counters)],
+            'cache': status_cache.stats()
+        }
+
+
+metrics = Metrics(10000)
+
+
+# Base revision contents keyed by the id the VCS gives them, e.g. ('git',
+# blob sha), ('svn', pristine sha1) or ('hgraw', filelog node), so contents
+# that haven't changed are never read twice. Contents are kept in memory up
+# to memory_size bytes, least recently used out first. Larger ones than
+# large_size are written to store_dir instead, if set and persist is True,
+# and read from there, with the least recently used files removed past
+# store_size bytes.
+class BlobCache():
+    def __init__(self, memory_size, store_size):
+        self.memory = LRUCache(memory_size)
+        self.store_size = store_size
+        self.large_size = 1048576
+        self.store_dir = None
+        self.lock = threading.Lock()
+
+    def get(self, key, load, persist=True):
+        data = self.memory.get(key)
+        if data != None:
+            return data
+
+        path = None
+        if persist:
+            path = self.get_store_path(key)
+        if path != None:
+            try:
+                data = read_file(path)
+                os.utime(path, None)
+                return data
+            except (IOError, OSError):
+                pass
+
+        data = load()
+        if data == None:
+            return None
+        if len(data) >= self.large_size and path != None:
+            self.store(path, data)
+        else:
+            self.memory.set(key, data, len(data))
+        return data
+
+    def get_store_path(self, key):
+        store_dir = self.store_dir
+        if store_dir == None:
+            return None
+        return os.path.join(store_dir, '-'.join(key))
+
+    def store(self, path, data):
+        with self.lock:
+            try:
+                if not os.path.isdir(self.store_dir):
+                    os.makedirs(self.store_dir)
+                f = open(path + '.tmp', 'wb')
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+                if os.name == 'nt' and os.path.exists(path):
+                    os.remove(path)
+                os.rename(path + '.tmp', path)
+                self.prune()
+            except (IOError, OSError):
+                pass
+
+    def prune(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.store_dir):
+            stat = os.stat(os.path.join(self.store_dir, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+            total += stat.st_size
+        files.sort()
+        while total > self.store_size and len(files) > 1:
+            mtime, name, size = files.pop(0)
+            os.remove(os.path.join(self.store_dir, name))
+            total -= size
+
+
+blob_cache = BlobCache(67108864, 268435456)
+
+
+def show_error(message):
+    sublime.set_timeout(lambda: sublime.error_message(message), 0)
+
+
+# Runs status requests in priority order (0 for requests from menus, 1 for
+# prefetching), dropping requests for keys that are already queued with
+# the same or a higher priority. Paths to look up are collected per working
+# copy and priority, so they are all answered by a single request.
+class StatusWorker(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue.PriorityQueue()
+        self.pending = {}
+        self.prefetch_paths = {}
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def add(self, key, priority, function, *args):
+        with self.lock:
+            if key in self.pending and self.pending[key][0] <= priority:
+                return
+            self.counter += 1
+            token = (priority, self.counter)
+            self.pending[key] = token
+            if not self.isAlive():
+                self.start()
+        self.queue.put((token, key, function, args))
+
+    def prefetch(self, tortoise, vcs, paths, options, priority=1):
+        key = (tortoise.root_dir, 'prefetch', priority)
+        with self.lock:
+            self.prefetch_paths.setdefault(key, set()).update(paths)
+        self.add(key, priority, self.run_prefetch, key, tortoise, vcs,
+            options)
+
+    def run_prefetch(self, key, tortoise, vcs, options):
+        with self.lock:
+            paths = self.prefetch_paths.pop(key, set())
+            # Paths added from now on need a new request
+            self.pending.pop(key, None)
+        tortoise.prefetch_status(vcs, paths, options)
 
     def run(self):
+        while True:
+            token, key, function, args = self.queue.get()
+            with self.lock:
+                if self.pending.get(key) != token:
+                    continue
+            try:
+                function(*args)
+            except (Exception):
+                # A failed request mustn't stop the worker
+                traceback.print_exc()
+            finally:
+                with self.lock:
+                    if self.pending.get(key) == token:
+                        del self.pending[key]
+
+
+status_worker = StatusWorker()
+# Blame and log run their potentially long commands on a worker of their
+# own, so they never hold up the statuses the menus wait for
+history_worker = StatusWorker()
+
+
+class StatusTreeNode():
+    def __init__(self):
+        self.children = {}
+        self.tracked = False
+        self.modified = False
+        self.conflicted = False
+
+
+# The statuses of every versioned and changed path in a working copy,
+# as returned by check_root_status(). Versioned, unmodified paths have the
+# status ''. Folders are aggregated into a tree while loading, so the
+# status of any folder is answered by walking down its path. The paths that
+# aren't unmodified or ignored are also kept in changes, sorted.
+class StatusSnapshot():
+    def __init__(self, root_dir, statuses):
+        self.root_dir = root_dir
+        self.time = time.time()
+        self.statuses = {}
+        self.changes = []
+        self.tree = StatusTreeNode()
+        for path, status in statuses.items():
+            path = self.normalize(path)
+            self.statuses[path] = status
+            self.add_to_tree(path, status)
+            if status not in ['', 'I']:
+                self.changes.append(path)
+        self.changes.sort()
+
+    def normalize(self, path):
+        return os.path.normcase(os.path.normpath(path))
+
+    def add_to_tree(self, path, status):
+        if status in ['?', 'I']:
+            return
+        parts = path.split(os.sep)
+        # Unmodified files don't need nodes of their own
+        if status == '':
+            parts = parts[:-1]
+        node = self.tree
+        nodes = [node]
+        for part in parts:
+            if part not in node.children:
+                node.children[part] = StatusTreeNode()
+            node = node.children[part]
+            nodes.append(node)
+        for node in nodes:
+            node.tracked = True
+            if status in ['C', 'U']:
+                node.conflicted = True
+            elif status != '':
+                node.modified = True
+
+    def get_status(self, path):
+        is_dir = os.path.isdir(path)
+        path = self.normalize(os.path.relpath(path, self.root_dir))
+        if path in self.statuses and not is_dir:
+            return self.statuses[path]
+
+        # Git and SVN only report the top-most directory of an unversioned
+        # tree, so everything below it inherits that status
+        parent = path
+        while parent and parent != '.':
+            if self.statuses.get(parent) in ['?', 'I']:
+                return self.statuses[parent]
+            parent = os.path.dirname(parent)
+
+        if is_dir:
+            return self.get_directory_status(path)
+        return ''
+
+    def get_directory_status(self, path):
+        node = self.tree
+        if path != '.':
+            for part in path.split(os.sep):
+                node = node.children.get(part)
+                if node == None:
+                    return '?'
+        if not node.tracked:
+            return '?'
+        if node.conflicted:
+            return 'C'
+        if node.modified:
+            return 'M'
+        return ''
+
+
+# Decodes file contents from the VCS into lines comparable to a view's
+def split_lines(contents):
+    try:
+        contents = contents.decode('utf-8')
+    except (UnicodeDecodeError):
+        contents = contents.decode('latin-1')
+    contents = contents.replace('\r\n', '\n').replace('\r', '\n')
+    return contents.split('\n')
+
+
+# Keeps the differences between the base revision of a file and its current
+# lines up to date as it is edited. Only the lines around an edit, widened
+# to the hunks they touch, are compared again. Hunks are (base start, base
+# end, start, end), with the ends exclusive.
+class LineDiff():
+    def __init__(self, base_lines):
+        self.base_lines = base_lines
+        self.lines = base_lines
+        self.hunks = []
+
+    def update(self, lines):
+        old_lines = self.lines
+        self.lines = lines
+
+        # The edited range, by trimming the lines that didn't change
+        start = 0
+        limit = min(len(old_lines), len(lines))
+        while start < limit and old_lines[start] == lines[start]:
+            start += 1
+        old_end = len(old_lines)
+        end = len(lines)
+        while old_end > start and end > start and \
+                old_lines[old_end - 1] == lines[end - 1]:
+            old_end -= 1
+            end -= 1
+        if start == old_end and start == end:
+            return self.hunks
+
+        before = []
+        touched = []
+        after = []
+        for hunk in self.hunks:
+            if hunk[3] < start:
+                before.append(hunk)
+            elif hunk[2] > old_end:
+                after.append(hunk)
+            else:
+                touched.append(hunk)
+
+        # Outside of hunks, lines only differ from the base in position
+        offset = 0
+        for hunk in before:
+            offset += (hunk[3] - hunk[2]) - (hunk[1] - hunk[0])
+        window_start = min([start] + [hunk[2] for hunk in touched])
+        window_end = max([old_end] + [hunk[3] for hunk in touched])
+        base_start = window_start - offset
+        for hunk in touched:
+            offset += (hunk[3] - hunk[2]) - (hunk[1] - hunk[0])
+        base_end = window_end - offset
+        shift = end - old_end
+
+        hunks = before
+        matcher = difflib.SequenceMatcher(None,
+            self.base_lines[base_start:base_end],
+            lines[window_start:window_end + shift])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != 'equal':
+                hunks.append((base_start + i1, base_start + i2,
+                    window_start + j1, window_start + j2))
+        for hunk in after:
+            hunks.append((hunk[0], hunk[1], hunk[2] + shift,
+                hunk[3] + shift))
+        self.hunks = hunks
+        return hunks
+
+    # The base line a current line came from, or None if it was changed
+    def get_base_line(self, line):
+        offset = 0
+        for base_start, base_end, start, end in self.hunks:
+            if line < start:
+                break
+            if line < end:
+                return None
+            offset += (end - start) - (base_end - base_start)
+        return line - offset
+
+    # The added and modified line numbers, the line numbers deletions
+    # happened before and the number of deleted lines
+    def get_changes(self):
+        added = []
+        modified = []
+        deleted = []
+        deleted_count = 0
+        for base_start, base_end, start, end in self.hunks:
+            if start == end:
+                deleted.append(start)
+                deleted_count += base_end - base_start
+            elif base_start == base_end:
+                added.extend(range(start, end))
+            else:
+                modified.extend(range(start, end))
+        return (added, modified, deleted, deleted_count)
+
+
+# What is known about the changes in a view. text is the latest contents to
+# be compared, which the worker picks up when it gets to the view.
+class ViewChanges():
+    def __init__(self):
+        self.generation = 0
+        self.text = None
+        self.path = None
+        self.signature = None
+        self.diff = None
+
+
+# The blame of a file as of a revision. lines maps line indexes of the
+# blamed revision to (contents, info), and is filled in as the blame is
+# read.
+class Blame():
+    def __init__(self):
+        self.lines = {}
+        self.complete = False
+
+
+# Inline blame for a view. diff maps the view's lines to the blamed lines,
+# so edits don't need a new blame. panel is the view showing the
+# annotations, and position the scroll position it was last synced to.
+class ViewBlame():
+    def __init__(self):
+        self.generation = 0
+        self.text = None
+        self.blame = None
+        self.diff = None
+        self.panel = None
+        self.position = None
+        self.layout_changed = False
+
+
+# The history of a file or folder, newest first, as far as it has been read.
+# Each entry is a dict of id, revision, author, date and summary.
+class LogHistory():
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.complete = False
+
+
+# The changed files of a set of working copies, shown in view, or in a quick
+# panel if view is None. changes maps each root_dir to a sorted list of
+# (path, status), or None until it has been listed. Each working copy's
+# section of the view is tracked as a region, so it can be replaced without
+# moving the selection or scroll position in the others.
+class ChangedFiles():
+    def __init__(self, vcses, view):
+        self.vcses = sorted(vcses, key=lambda vcs: vcs.root_dir)
+        self.view = view
+        self.window = None
+        self.changes = dict.fromkeys([vcs.root_dir for vcs in self.vcses])
+        self.rendered = False
+
+    # Takes what it can from the cache and asks the status worker for the
+    # rest
+    def refresh(self, priority):
+        root_dirs = []
+        for vcs in self.vcses:
+            options = vcs.get_status_options()
+            snapshot = status_cache.get(vcs.snapshot_key(),
+                options['cache_length'], vcs.get_index_signature())
+            if snapshot != None:
+                changes = list_changes(snapshot)
+                if changes != self.changes[vcs.root_dir]:
+                    self.changes[vcs.root_dir] = changes
+                    root_dirs.append(vcs.root_dir)
+            else:
+                status_worker.add((vcs.root_dir, 'changes'), priority,
+                    vcs.fetch_changes, vcs.get_backend(), options)
+        self.update(root_dirs)
+
+    # Shows the changes, rendering only the sections of root_dirs if they
+    # are already in the view
+    def update(self, root_dirs):
+        if self.view != None:
+            self.render(root_dirs)
+        elif None not in self.changes.values():
+            changed_files.pop(('panel', self.window.id()), None)
+            self.show_panel()
+        else:
+            sublime.status_message('Listing changed files...')
+
+    def render(self, root_dirs):
+        self.view.set_read_only(False)
+        edit = self.view.begin_edit()
+        for i, vcs in enumerate(self.vcses):
+            key = 'tortoise_changed_files_%d' % i
+            if self.rendered and vcs.root_dir not in root_dirs:
+                continue
+            if self.rendered:
+                region = self.view.get_regions(key)[0]
+            else:
+                if i > 0:
+                    self.view.insert(edit, self.view.size(), '\n\n')
+                region = sublime.Region(self.view.size(), self.view.size())
+            size = self.view.size()
+            self.view.replace(edit, region, self.format_section(vcs))
+            region = sublime.Region(region.begin(),
+                region.end() + self.view.size() - size)
+            self.view.add_regions(key, [region], '', '', sublime.HIDDEN)
+        self.view.end_edit(edit)
+        self.view.set_read_only(True)
+        self.rendered = True
+
+    def format_section(self, vcs):
+        changes = self.changes[vcs.root_dir]
+        lines = [vcs.root_dir]
+        if changes == None:
+            lines.append('  loading...')
+        elif not changes:
+            lines.append('  no changes')
+        for path, status in changes or []:
+            lines.append('  %s  %s' % (status, path))
+        return '\n'.join(lines)
+
+    def show_panel(self):
+        items = []
+        paths = []
+        for vcs in self.vcses:
+            for path, status in self.changes[vcs.root_dir]:
+                items.append([os.path.relpath(path, vcs.root_dir),
+                    '%s  %s' % (status, vcs.root_dir)])
+                paths.append(path)
+        if not items:
+            sublime.status_message('No changed files')
+            return
+
+        def on_done(index):
+            if index != -1 and not os.path.isdir(paths[index]):
+                self.window.open_file(paths[index])
+        self.window.show_quick_panel(items, on_done)
+
+
+# ChangedFiles keyed by the id of the view showing them, or by ("panel",
+# window id) while waiting to show a quick panel
+changed_files = {}
+
+
+# The changed files in a snapshot, as (path, status) sorted by path
+def list_changes(snapshot):
+    return [(os.path.join(snapshot.root_dir, path), snapshot.statuses[path])
+        for path in snapshot.changes]
+
+
+# Called whenever a snapshot is stored, from any thread, so the changed
+# files being shown are updated
+def report_snapshot(snapshot):
+    if changed_files:
+        report_changes(snapshot.root_dir, list_changes(snapshot))
+
+
+def report_changes(root_dir, changes):
+    def update():
+        for state in changed_files.values():
+            if root_dir in state.changes and \
+                    state.changes[root_dir] != changes:
+                state.changes[root_dir] = changes
+                state.update([root_dir])
+    sublime.set_timeout(update, 0)
+
+
+class TortoiseProc(Tortoise):
+    # TortoiseProc takes multiple paths separated by *
+    def format_paths(self, paths):
+        return '*'.join([os.path.relpath(path, self.root_dir)
+            for path in paths])
+
+    def status(self, path=None):
+        path = self.root_dir if path == None else path
+        path = os.path.relpath(path, self.root_dir)
+        ForkGui('"' + self.get_gui_path() + '" /command:repostatus ' +
+            '/path:"%s"' % path, self.root_dir)
+
+    def commit(self, paths=None):
+        paths = [self.root_dir] if paths == None else paths
+        ForkGui('"' + self.get_gui_path() + '" /command:commit /path:"%s"' %
+            self.format_paths(paths), self.root_dir)
+
+    def log(self, path=None):
+        path = self.root_dir if path == None else path
+        path = os.path.relpath(path, self.root_dir)
+        ForkGui('"' + self.get_gui_path() + '" /command:log /path:"%s"' % path,
+            self.root_dir)
+
+    def blame(self, path=None):
+        path = self.root_dir if path == None else path
+        path = os.path.relpath(path, self.root_dir)
+        ForkGui('"' + self.get_gui_path() + '" /command:blame /path:"%s"' %
+            path, self.root_dir)
+
+    # The diff command only accepts a single path
+    def diff(self, paths):
+        for path in paths:
+            path = os.path.relpath(path, self.root_dir)
+            ForkGui('"' + self.get_gui_path() + '" /command:diff /path:"%s"' %
+                path, self.root_dir)
+
+    def add(self, paths):
+        ForkGui('"' + self.get_gui_path() + '" /command:add /path:"%s"' %
+            self.format_paths(paths), self.root_dir)
+
+    def remove(self, paths):
+        ForkGui('"' + self.get_gui_path() + '" /command:remove /path:"%s"' %
+            self.format_paths(paths), self.root_dir)
+
+    def revert(self, paths):
+        ForkGui('"' + self.get_gui_path() + '" /command:revert /path:"%s"' %
+            self.format_paths(paths), self.root_dir)
+
+
+class TortoiseSVN(TortoiseProc):
+    def __init__(self, binary_path, client_path, root_dir):
+        self.root_dir = root_dir
+        self.path = binary_path
+        candidates = []
+        if os.name == 'nt':
+            candidates.append(os.path.join(sublime.packages_path(),
+                __name__, 'svn', 'svn.exe'))
+        self.client_path = client_path or find_client('svn', candidates)
+
+    # TortoiseSVN is only looked for when it is launched, so statuses work
+    # without it
+    def get_gui_path(self):
+        if self.path == None:
+            self.set_binary_path('TortoiseSVN\\bin\\TortoiseProc.exe',
+                'TortoiseProc.exe', 'svn_tortoiseproc_path')
+        return self.path
+
+    def sync(self, path=None):
+        path = self.root_dir if path == None else path
+        path = os.path.relpath(path, self.root_dir)
+        ForkGui('"' + self.get_gui_path() + '" /command:update /path:"%s"' %
+            path, self.root_dir)
+
+    def get_index_files(self):
+        return [os.path.join(self.root_dir, '.svn', 'wc.db')]
+
+    def get_backend(self):
+        return SVN(self.client_path, self.root_dir)
+
+
+class TortoiseGit(TortoiseProc):
+    def __init__(self, binary_path, client_path, root_dir):
+        self.root_dir = root_dir
+        self.path = binary_path
+        self.client_path = client_path or find_client('git',
+            self.find_bundled_clients(['TortoiseGit\\bin\\TortoiseProc.exe'],
+            'tgit.exe'))
+
+    def get_gui_path(self):
+        if self.path == None:
+            self.set_binary_path('TortoiseGit\\bin\\TortoiseProc.exe',
+                'TortoiseProc.exe', 'git_tortoiseproc_path')
+        return self.path
+
+    def sync(self, path=None):
+        path = self.root_dir if path == None else path
+        path = os.path.relpath(path, self.root_dir)
+        ForkGui('"' + self.get_gui_path() + '" /command:sync /path:"%s"' %
+            path, self.root_dir)
+
+    def get_index_files(self):
+        git_dir = find_git_dir(self.root_dir)
+        return [os.path.join(git_dir, 'index'), os.path.join(git_dir, 'HEAD')]
+
+    def get_backend(self):
+        return Git(self.client_path, self.root_dir)
+
+
+class TortoiseHg(Tortoise):
+    def __init__(self, binary_path, client_path, root_dir):
+        self.root_dir = root_dir
+        self.path = binary_path
+        self.client_path = client_path or find_client('hg',
+            self.find_bundled_clients(['TortoiseHg\\thgw.exe',
+            'TortoiseHg\\hgtk.exe'], 'hg.exe'))
+
+    def get_gui_path(self):
+        if self.path == None:
+            try:
+                self.set_binary_path('TortoiseHg\\thgw.exe',
+                    'thgw.exe', 'hg_hgtk_path')
+            except (NotFoundError):
+                self.set_binary_path('TortoiseHg\\hgtk.exe',
+                    'thgw.exe (for TortoiseHg v2.x) or hgtk.exe (for ' +
+                    'TortoiseHg v1.x)', 'hg_hgtk_path')
+        return self.path
+
+    def status(self, path=None):
+        path = os.path.relpath(path, self.root_dir)
+        args = [self.get_gui_path(), 'status', '--nofork', path]
+        ForkGui(args, self.root_dir)
+
+    def format_paths(self, paths):
+        return [os.path.relpath(path, self.root_dir) for path in paths]
+
+    def commit(self, paths=None):
+        paths = [self.root_dir] if paths == None else paths
+        args = [self.get_gui_path(), 'commit', '--nofork'] + \
+            self.format_paths(paths)
+        ForkGui(args, self.root_dir)
+
+    def sync(self, path=None):
+        path = os.path.relpath(path, self.root_dir)
+        args = [self.get_gui_path(), 'synch', '--nofork', path]
+        ForkGui(args, self.root_dir)
+
+    def log(self, path=None):
+        path = os.path.relpath(path, self.root_dir)
+        args = [self.get_gui_path(), 'log', '--nofork', path]
+        ForkGui(args, self.root_dir)
+
+    def blame(self, path=None):
+        path = os.path.relpath(path, self.root_dir)
+        args = [self.get_gui_path(), 'blame', '--nofork', path]
+        ForkGui(args, self.root_dir)
+
+    def diff(self, paths):
+        args = [self.get_gui_path(), 'vdiff', '--nofork'] + \
+            self.format_paths(paths)
+        ForkGui(args, self.root_dir)
+
+    def add(self, paths):
+        args = [self.get_gui_path(), 'add', '--nofork'] + \
+            self.format_paths(paths)
+        ForkGui(args, self.root_dir)
+
+    def remove(self, paths):
+        args = [self.get_gui_path(), 'remove', '--nofork'] + \
+            self.format_paths(paths)
+        ForkGui(args, self.root_dir)
+
+    def revert(self, paths):
+        args = [self.get_gui_path(), 'revert', '--nofork'] + \
+            self.format_paths(paths)
+        ForkGui(args, self.root_dir)
+
+    def get_index_files(self):
+        return [os.path.join(self.root_dir, '.hg', 'dirstate')]
+
+    def get_backend(self):
+        return Hg(self.client_path, self.root_dir)
+
+
+# Calls stop once timeout seconds have passed, unless finished first
+class ProcessTimer():
+    def __init__(self, timeout, stop):
+        self.stop = stop
+        self.timed_out = False
+        self.timer = None
+        if timeout:
+            self.timer = threading.Timer(timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def expire(self):
+        self.timed_out = True
+        try:
+            self.stop()
+        except (IOError, OSError):
+            pass
+
+    # Returns if the timeout passed
+    def finish(self):
+        if self.timer != None:
+            self.timer.cancel()
+        return self.timed_out
+
+
+# Keeps slow working copies from holding up the status worker. VCS commands
+# running longer than timeout seconds are stopped, and after max_timeouts
+# timeouts in a row no commands are run in the working copy for cooldown
+# seconds. Working copies that take longer than large_seconds to list, or
+# have more than large_files files, are switched to large repository mode,
+# where only the paths asked for are looked up and nothing is prefetched.
+# The working copy is listed again after cooldown seconds, and leaves large
+# repository mode if that is fast enough.
+class ProcessGuard():
+    def __init__(self):
+        self.timeout = 30
+        self.max_timeouts = 3
+        self.cooldown = 300
+        self.large_seconds = 5
+        self.large_files = 200000
+        self.timeouts = {}
+        self.blocked = {}
+        self.large_roots = {}
+        self.lock = threading.Lock()
+
+    def check(self, root_dir):
+        with self.lock:
+            until = self.blocked.get(root_dir)
+            if until == None:
+                return
+            if until > time.time():
+                raise ProcessBlockedError('Not running commands in %s ' %
+                    root_dir + 'after repeated timeouts')
+            del self.blocked[root_dir]
+
+    # Raises a ProcessTimeoutError if timer ran out
+    def finish(self, root_dir, description, timer):
+        if not timer.finish():
+            with self.lock:
+                self.timeouts.pop(root_dir, None)
+            return
+
+        metrics.count('timeout', root_dir)
+        with self.lock:
+            self.timeouts[root_dir] = self.timeouts.get(root_dir, 0) + 1
+            blocked = self.max_timeouts and \
+                self.timeouts[root_dir] >= self.max_timeouts
+            if blocked:
+                del self.timeouts[root_dir]
+                self.blocked[root_dir] = time.time() + self.cooldown
+        if blocked:
+            show_status('Tortoise: %s timed out repeatedly, pausing for %d '
+                'seconds' % (root_dir, self.cooldown))
+        raise ProcessTimeoutError('%s took longer than %s seconds' % (
+            description, self.timeout))
+
+    def measure(self, root_dir, seconds, files):
+        if (self.large_seconds and seconds > self.large_seconds) or \
+                (self.large_files and files > self.large_files):
+            self.set_large(root_dir)
+            return
+        with self.lock:
+            large = self.large_roots.pop(root_dir, None) != None
+        if large:
+            show_status('Tortoise: leaving large repository mode for ' +
+                root_dir)
+
+    def set_large(self, root_dir):
+        with self.lock:
+            large = root_dir in self.large_roots
+            self.large_roots[root_dir] = time.time()
+        if not large:
+            show_status('Tortoise: using large repository mode for ' +
+                root_dir)
+
+    def is_large(self, root_dir):
+        with self.lock:
+            since = self.large_roots.get(root_dir)
+            if since == None:
+                return False
+            if since > time.time() - self.cooldown:
+                return True
+            del self.large_roots[root_dir]
+            return False
+
+
+process_guard = ProcessGuard()
+
+
+def show_status(message):
+    sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+
+def kill_process(proc):
+    if os.name == 'nt':
+        proc.kill()
+    else:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+class NonInteractiveProcess():
+    def __init__(self, args, cwd=None):
+        self.args = args
+        self.cwd  = cwd
+        self.timer = None
+
+    def start(self, stderr=subprocess.STDOUT):
+        process_guard.check(self.cwd)
+        startupinfo = None
+        preexec_fn = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        else:
+            # A process group of its own, so a timeout also stops any
+            # processes it started, which could keep the output open
+            preexec_fn = os.setsid
+
+        proc = subprocess.Popen(self.args, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=stderr,
+            startupinfo=startupinfo, cwd=self.cwd, preexec_fn=preexec_fn)
+        self.timer = ProcessTimer(process_guard.timeout,
+            lambda: kill_process(proc))
+        return proc
+
+    # The name the process is recorded under in the metrics, e.g.
+    # "process git status"
+    def describe(self):
+        name = os.path.splitext(os.path.basename(self.args[0]))[0]
+        return ' '.join(['process', name] + self.args[1:2])
+
+    def run(self):
+        start_time = time.time()
+        proc = self.start()
+        output = proc.stdout.read()
+        metrics.record(self.describe(), self.cwd, time.time() - start_time,
+            len(output))
+        process_guard.finish(self.cwd, self.describe(), self.timer)
+        return output.replace('\r\n', '\n').rstrip(' \n\r')
+
+    # Yields the output as it arrives. Closing the generator early stops the
+    # process, so callers can quit once they found what they need.
+    def iter_chunks(self):
+        start_time = time.time()
+        size = 0
+        proc = self.start(open(os.devnull, 'w'))
+        try:
+            while True:
+                chunk = os.read(proc.stdout.fileno(), 65536)
+                if not chunk:
+                    break
+                size += len(chunk)
+                yield chunk
+            process_guard.finish(self.cwd, self.describe(), self.timer)
+        finally:
+            self.timer.finish()
+            metrics.record(self.describe(), self.cwd,
+                time.time() - start_time, size)
+            proc.stdout.close()
+            if proc.poll() == None:
+                try:
+                    proc.terminate()
+                except (OSError):
+                    pass
+
+
+def iter_records(chunks, separator='\n'):
+    remainder = ''
+    for chunk in chunks:
+        records = (remainder + chunk).split(separator)
+        remainder = records.pop()
+        for record in records:
+            yield record.rstrip('\r') if separator == '\n' else record
+    if remainder:
+        yield remainder
+
+
+# git status --porcelain -z, where renames and copies are followed by an
+# extra record with the original path
+def parse_git_status(chunks):
+    records = iter_records(chunks, '\0')
+    for record in records:
+        if len(record) < 4:
+            continue
+        if record[0] in 'RC' or record[1] in 'RC':
+            records.next()
+        status = record[0] if record[0] != ' ' else record[1]
+        yield (record[3:].rstrip('/'), status.upper())
+
+
+# With verbose, unmodified items are listed too, with their revisions and
+# author between the status columns and the path
+def parse_svn_status(chunks, verbose=False):
+    for line in iter_records(chunks):
+        # Skip tree conflict descriptions, changelist headers and
+        # externals notices, which don't follow the column layout
+        if len(line) < 9 or line[7] != ' ' or line[0] == '>' or \
+                line.startswith('---'):
+            continue
+        status = line[0]
+        if line[6] == 'C':
+            status = 'C'
+        if status == ' ':
+            status = line[1]
+        path = line[8:]
+        if verbose and status in ['?', 'I']:
+            path = path.lstrip()
+        elif verbose:
+            path = path.split(None, 3)[-1]
+        if status == ' ':
+            if not verbose:
+                continue
+            status = ''
+        yield (path, status)
+
+
+svn_xml_statuses = {
+    'normal': '',
+    'none': '',
+    'added': 'A',
+    'conflicted': 'C',
+    'deleted': 'D',
+    'external': 'X',
+    'ignored': 'I',
+    'incomplete': '!',
+    'merged': 'G',
+    'missing': '!',
+    'modified': 'M',
+    'obstructed': '~',
+    'replaced': 'R',
+    'unversioned': '?'
+}
+
+
+# svn status --xml, parsed incrementally as the output arrives
+def parse_svn_status_xml(chunks):
+    entries = []
+    current = {}
+
+    def start_element(name, attributes):
+        if name == 'entry':
+            current['path'] = attributes.get('path')
+        elif name == 'wc-status' and current.get('path') != None:
+            status = svn_xml_statuses.get(attributes.get('item'))
+            if attributes.get('tree-conflicted') == 'true' or \
+                    (not status and attributes.get('props') == 'conflicted'):
+                status = 'C'
+            elif not status and attributes.get('props') == 'modified':
+                status = 'M'
+            if status != None:
+                entries.append((current['path'], status))
+            current['path'] = None
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+        for entry in entries:
+            yield entry
+        del entries[:]
+    parser.Parse('', True)
+    for entry in entries:
+        yield entry
+
+
+# hg status -0, where C means clean rather than conflicted
+def parse_hg_status(chunks):
+    for record in iter_records(chunks, '\0'):
+        if len(record) >= 3:
+            status = record[0].upper()
+            yield (record[2:], '' if status == 'C' else status)
+
+
+def format_blame_date(timestamp):
+    return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+
+# git blame --porcelain, yielding (line index, contents, info) where info is
+# a dict of revision, author, date and summary shared by the commit's lines
+def parse_git_blame(chunks):
+    commits = {}
+    info = None
+    line = None
+    for record in iter_records(chunks):
+        if record.startswith('\t'):
+            yield (line, record[1:], info)
+        elif re.match('[0-9a-f]{40} \\d+ \\d+', record):
+            fields = record.split(' ')
+            line = int(fields[2]) - 1
+            if fields[0] not in commits:
+                commits[fields[0]] = {'revision': fields[0][0:8],
+                    'author': '', 'date': '', 'summary': ''}
+            info = commits[fields[0]]
+        elif info != None:
+            key, value = (record.split(' ', 1) + [''])[0:2]
+            if key in ['author', 'summary']:
+                info[key] = value
+            elif key == 'author-time':
+                info['date'] = format_blame_date(int(value))
+
+
+# svn blame, where each line is "revision author contents"
+def parse_svn_blame(chunks):
+    infos = {}
+    line = 0
+    for record in iter_records(chunks):
+        match = re.match('\\s*(\\d+|-)\\s+(\\S+) (.*)$', record)
+        if match == None:
+            continue
+        revision, author, contents = match.groups()
+        if (revision, author) not in infos:
+            infos[(revision, author)] = {'revision': 'r' + revision,
+                'author': author, 'date': '', 'summary': ''}
+        yield (line, contents, infos[(revision, author)])
+        line += 1
+
+
+# hg annotate -T json
+def parse_hg_blame(output):
+    infos = {}
+    line = 0
+    for file in json.loads(output):
+        for entry in file['lines']:
+            node = entry.get('node', '')
+            if node not in infos:
+                date = entry.get('date')
+                infos[node] = {'revision': node[0:12],
+                    'author': entry.get('user', ''),
+                    'date': format_blame_date(date[0]) if date else '',
+                    'summary': ''}
+            contents = entry['line'].encode('utf-8')
+            yield (line, contents.rstrip('\r\n'), infos[node])
+            line += 1
+
+
+# Log entries written by git log and hg log with fields separated by \x1f
+# and entries by \x1e, in the order of fields
+def parse_log(output, fields):
+    entries = []
+    for record in output.split('\x1e'):
+        values = record.lstrip('\n').split('\x1f')
+        if len(values) == len(fields):
+            entries.append(dict(zip(fields, values)))
+    return entries
+
+
+# svn log, where each entry starts with "r1 | author | date | 1 line",
+# followed by an empty line and the message
+def parse_svn_log(chunks):
+    entries = []
+    entry = None
+    for record in iter_records(chunks):
+        match = re.match('r(\\d+) \\| (.*) \\| (\\d+-\\d+-\\d+)[^|]* ' +
+            '\\| \\d+ lines?$', record)
+        if match != None:
+            number, author, date = match.groups()
+            entry = {'id': number, 'revision': 'r' + number,
+                'number': int(number), 'author': author, 'date': date,
+                'summary': ''}
+            entries.append(entry)
+        elif record.startswith('-' * 72):
+            entry = None
+        elif entry != None and not entry['summary'] and record.strip():
+            entry['summary'] = record.strip()
+    return entries
+
+
+# The status of a folder from the statuses of the changes in it
+def get_changes_status(statuses):
+    if 'C' in statuses or 'U' in statuses:
+        return 'C'
+    return 'M' if statuses else ''
+
+
+def same_path(root_dir, path, other_path):
+    return os.path.normcase(os.path.normpath(os.path.join(root_dir,
+        path))) == os.path.normcase(os.path.normpath(os.path.join(root_dir,
+        other_path)))
+
+
+class HelperProcessError(Exception):
+    pass
+
+
+# A long-running VCS process that is kept open between requests. Requests
+# are serialized by the lock, so concurrent callers queue up behind it.
+class HelperProcess():
+    def __init__(self, args, cwd):
+        self.args = args
+        self.cwd = cwd
+        self.proc = None
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+    def start(self):
         startupinfo = None
         if os.name == 'nt':
             startupinfo = subprocess.STARTUPINFO()
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
 
-        proc = subprocess.Popen(self.args, stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            startupinfo=startupinfo, cwd=self.cwd)
+        try:
+            self.proc = subprocess.Popen(self.args, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'),
+                startupinfo=startupinfo, cwd=self.cwd)
+        except (OSError) as (exception):
+            raise HelperProcessError(str(exception))
+
+    # A request that times out stops the process and raises a
+    # ProcessTimeoutError rather than a HelperProcessError, so callers don't
+    # retry it with a new process
+    def request(self, *args):
+        process_guard.check(self.cwd)
+        description = 'helper ' + self.__class__.__name__
+        with self.lock:
+            self.last_used = time.time()
+            timer = ProcessTimer(None, None)
+            try:
+                if self.proc == None or self.proc.poll() != None:
+                    self.start()
+                timer = ProcessTimer(process_guard.timeout, self.proc.kill)
+                result = self.handle(*args)
+                process_guard.finish(self.cwd, description, timer)
+                metrics.record(description, self.cwd,
+                    time.time() - self.last_used)
+                return result
+            except (ProcessTimeoutError):
+                self.stop()
+                raise
+            except (IOError, OSError, ValueError, struct.error,
+                    HelperProcessError) as (exception):
+                self.stop()
+                if timer.finish():
+                    process_guard.finish(self.cwd, description, timer)
+                if isinstance(exception, HelperProcessError):
+                    raise
+                raise HelperProcessError(str(exception))
+            finally:
+                # Other errors, e.g. a NativeStatusError for a missing git
+                # object, leave the process usable, so it mustn't be killed
+                # later by the timer
+                timer.finish()
+
+    def stop(self):
+        proc = self.proc
+        self.proc = None
+        if proc == None:
+            return
+        try:
+            proc.stdin.close()
+            if proc.poll() == None:
+                proc.terminate()
+        except (IOError, OSError):
+            pass
+
+    def is_idle(self, timeout):
+        return self.proc != None and self.last_used < time.time() - timeout
+
+
+# Speaks the protocol of Mercurial's command server (hg serve --cmdserver)
+class HgCommandServer(HelperProcess):
+    def __init__(self, hg_path, root_dir):
+        HelperProcess.__init__(self, [hg_path, 'serve', '--cmdserver', 'pipe',
+            '--config', 'ui.interactive=False'], root_dir)
+
+    def start(self):
+        HelperProcess.start(self)
+        channel, data = self.read_message()
+        if channel != 'o' or 'runcommand' not in data:
+            raise HelperProcessError('Unexpected hello from the Mercurial ' +
+                'command server')
+
+    def read_message(self):
+        header = self.proc.stdout.read(5)
+        if len(header) < 5:
+            raise HelperProcessError('The Mercurial command server exited')
+        channel, length = struct.unpack('>cI', header)
+        if channel in 'IL':
+            return (channel, length)
+        return (channel, self.proc.stdout.read(length))
 
-        return proc.stdout.read().replace('\r\n', '\n').rstrip(' \n\r')
+    # Like NonInteractiveProcess, the output is normalized unless raw is
+    # set, in which case it is only what the command wrote to stdout
+    def handle(self, args, raw=False):
+        data = '\0'.join(args)
+        self.proc.stdin.write('runcommand\n' + struct.pack('>I', len(data)) +
+            data)
+        self.proc.stdin.flush()
+
+        output = []
+        while True:
+            channel, data = self.read_message()
+            if channel == 'o' or (channel == 'e' and not raw):
+                output.append(data)
+            elif channel == 'r':
+                break
+            elif channel in 'IL':
+                self.proc.stdin.write(struct.pack('>I', 0))
+                self.proc.stdin.flush()
+            elif channel.isupper():
+                raise HelperProcessError('Unsupported Mercurial command ' +
+                    'server channel ' + channel)
+        if raw:
+            return ''.join(output)
+        return ''.join(output).replace('\r\n', '\n').rstrip(' \n\r')
+
+
+class GitCatFile(HelperProcess):
+    def __init__(self, git_path, root_dir):
+        HelperProcess.__init__(self, [git_path, 'cat-file', '--batch'],
+            root_dir)
+
+    def handle(self, sha):
+        self.proc.stdin.write(sha + '\n')
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if len(header) != 3:
+            raise NativeStatusError('Unable to find git object ' + sha)
+        data = self.proc.stdout.read(int(header[2]))
+        self.proc.stdout.read(1)
+        return (header[1], data)
+
+
+# Keeps one helper process per class, binary and working copy, stopping
+# those that weren't used for idle_timeout seconds
+class HelperProcessPool():
+    def __init__(self):
+        self.helpers = {}
+        self.idle_timeout = 300
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def get(self, cls, binary_path, root_dir):
+        key = (cls.__name__, binary_path, root_dir)
+        with self.lock:
+            if key not in self.helpers:
+                self.helpers[key] = cls(binary_path, root_dir)
+            if self.reaper == None:
+                self.reaper = threading.Thread(target=self.reap)
+                self.reaper.daemon = True
+                self.reaper.start()
+            return self.helpers[key]
+
+    def reap(self):
+        while True:
+            time.sleep(30)
+            with self.lock:
+                helpers = self.helpers.values()
+            for helper in helpers:
+                if helper.is_idle(self.idle_timeout) and \
+                        helper.lock.acquire(False):
+                    try:
+                        helper.stop()
+                    finally:
+                        helper.lock.release()
+
+
+helper_processes = HelperProcessPool()
 
 
 class SVN():
-    def __init__(self, root_dir):
+    def __init__(self, svn_path, root_dir):
         self.root_dir = root_dir
+        self.svn_path = svn_path
 
     def check_status(self, path):
-        svn_path = os.path.join(sublime.packages_path(), __name__, 'svn',
-            'svn.exe')
-        proc = NonInteractiveProcess([svn_path, 'status', path],
+        proc = NonInteractiveProcess([self.svn_path, 'status', '--depth',
+            'empty', path], cwd=self.root_dir)
+        for status_path, status in parse_svn_status(proc.iter_chunks()):
+            if same_path(self.root_dir, status_path, path):
+                return status
+        return ''
+
+    # Unversioned folders have no changes either, but aren't clean
+    def check_directory_status(self, path):
+        status = get_changes_status(self.check_changes(path).values())
+        if status == '':
+            return self.check_status(path)
+        return status
+
+    # The changed paths in path, leaving out unversioned ones
+    def check_changes(self, path):
+        proc = NonInteractiveProcess([self.svn_path, 'status', '-q', path],
             cwd=self.root_dir)
-        result = proc.run().split('\n')
-        for line in result:
-            if len(line) < 1:
-                continue
+        return dict(parse_svn_status(proc.iter_chunks()))
 
-            path_without_root = path.replace(self.root_dir + '\\', '', 1)
-            path_regex = re.escape(path_without_root) + '$'
-            if self.root_dir != path and re.search(path_regex, line) == None:
-                continue
+    def check_native_status(self, path, load=True):
+        if sqlite3 == None:
+            return None
+        if self.root_dir not in svn_working_copies:
+            svn_working_copies[self.root_dir] = SVNWorkingCopy(self.root_dir)
+        return svn_working_copies[self.root_dir].get_status(path, load)
 
-            return line[0]
-        return ''
+    def get_base_contents(self, path):
+        if sqlite3 != None:
+            if self.root_dir not in svn_working_copies:
+                svn_working_copies[self.root_dir] = SVNWorkingCopy(
+                    self.root_dir)
+            working_copy = svn_working_copies[self.root_dir]
+            checksum = working_copy.get_base_id(path)
+            if checksum != None:
+                contents = blob_cache.get(('svn', checksum),
+                    lambda: working_copy.read_pristine(checksum), False)
+                if contents != None:
+                    return contents
+        proc = NonInteractiveProcess([self.svn_path, 'cat', '-r', 'BASE',
+            path], cwd=self.root_dir)
+        return ''.join(proc.iter_chunks())
+
+    # What the blame of a file depends on, None if it isn't versioned
+    def get_blame_revision(self, path):
+        if sqlite3 != None:
+            if self.root_dir not in svn_working_copies:
+                svn_working_copies[self.root_dir] = SVNWorkingCopy(
+                    self.root_dir)
+            return svn_working_copies[self.root_dir].get_base_id(path)
+        return None
+
+    # svn blame can't be limited to a range of lines, so start and end are
+    # ignored
+    def annotate(self, path, start=None, end=None):
+        proc = NonInteractiveProcess([self.svn_path, 'blame', path],
+            cwd=self.root_dir)
+        return parse_svn_blame(proc.iter_chunks())
+
+    # The next limit entries of the history of path, following the entries
+    # already read
+    def get_log(self, path, previous, limit):
+        args = [self.svn_path, 'log', '--limit', str(limit)]
+        if previous:
+            if previous[-1]['number'] <= 1:
+                return []
+            args.extend(['-r', '%d:1' % (previous[-1]['number'] - 1)])
+        proc = NonInteractiveProcess(args + [path], cwd=self.root_dir)
+        return parse_svn_log(proc.iter_chunks())
+
+    def show_revision(self, path, entry):
+        log = NonInteractiveProcess([self.svn_path, 'log', '-v', '-r',
+            entry['id'], path], cwd=self.root_dir).run()
+        diff = NonInteractiveProcess([self.svn_path, 'diff', '-c',
+            entry['id'], path], cwd=self.root_dir).run()
+        return log + '\n\n' + diff + '\n'
+
+    def check_root_status(self):
+        if expat != None:
+            proc = NonInteractiveProcess([self.svn_path, 'status', '--xml',
+                '--verbose'], cwd=self.root_dir)
+            return dict(parse_svn_status_xml(proc.iter_chunks()))
+        proc = NonInteractiveProcess([self.svn_path, 'status', '--verbose'],
+            cwd=self.root_dir)
+        return dict(parse_svn_status(proc.iter_chunks(), True))
 
 
 class Git():
-    def __init__(self, tortoise_proc_path, root_dir):
-        self.git_path = os.path.dirname(tortoise_proc_path) + '\\tgit.exe'
+    def __init__(self, git_path, root_dir):
+        self.git_path = git_path
         self.root_dir = root_dir
 
     def check_status(self, path):
-        if os.path.isdir(path):
-            proc = NonInteractiveProcess([self.git_path, 'log', '-1', path],
-                cwd=self.root_dir)
-            result = proc.run().strip().split('\n')
-            if result == ['']:
-                return '?'
-            return ''
+        proc = NonInteractiveProcess([self.git_path, 'status', '--porcelain',
+            '-z', '--', path], cwd=self.root_dir)
+        for status_path, status in parse_git_status(proc.iter_chunks()):
+            if same_path(self.root_dir, status_path, path):
+                return status
+        return ''
+
+    def check_directory_status(self, path):
+        status = get_changes_status(self.check_changes(path).values())
+        if status == '' and not self.has_tracked(path):
+            return '?'
+        return status
+
+    # Stops listing at the first tracked file
+    def has_tracked(self, path):
+        proc = NonInteractiveProcess([self.git_path, 'ls-files', '-z', '--',
+            path], cwd=self.root_dir)
+        for record in iter_records(proc.iter_chunks(), '\0'):
+            return True
+        return False
+
+    def check_changes(self, path):
+        proc = NonInteractiveProcess([self.git_path, 'status', '--porcelain',
+            '-z', '-uno', '--', path], cwd=self.root_dir)
+        return dict(parse_git_status(proc.iter_chunks()))
+
+    def get_repository(self):
+        if self.root_dir not in git_repositories:
+            git_repositories[self.root_dir] = GitRepository(self.root_dir,
+                self.git_path)
+        return git_repositories[self.root_dir]
+
+    def check_native_status(self, path, load=True):
+        return self.get_repository().get_status(path, load)
+
+    def get_base_contents(self, path):
+        sha = self.get_repository().get_base_id(path)
+        if sha == None:
+            proc = NonInteractiveProcess([self.git_path, 'ls-files', '-s',
+                '--', path], cwd=self.root_dir)
+            fields = proc.run().split('\t')[0].split(' ')
+            if len(fields) < 2:
+                return None
+            sha = fields[1]
+        return blob_cache.get(('git', sha), lambda: self.read_blob(sha))
+
+    def read_blob(self, sha):
+        contents = self.get_repository().read_blob(sha)
+        if contents != None:
+            return contents
+        proc = NonInteractiveProcess([self.git_path, 'cat-file', 'blob', sha],
+            cwd=self.root_dir)
+        return ''.join(proc.iter_chunks())
+
+    def get_blame_revision(self, path):
+        try:
+            head = self.get_repository().get_head_commit()
+        except (IOError, OSError):
+            head = None
+        if head == None:
+            head = NonInteractiveProcess([self.git_path, 'rev-parse', 'HEAD'],
+                cwd=self.root_dir).run()
+        # Without any commits there is nothing to blame
+        if not re.match('[0-9a-f]{40}$', head):
+            return None
+        return head
+
+    def annotate(self, path, start=None, end=None):
+        args = [self.git_path, 'blame', '--porcelain']
+        if start != None:
+            args.extend(['-L', '%d,%d' % (start + 1, end)])
+        proc = NonInteractiveProcess(args + ['HEAD', '--', path],
+            cwd=self.root_dir)
+        return parse_git_blame(proc.iter_chunks())
+
+    def get_log(self, path, previous, limit):
+        proc = NonInteractiveProcess([self.git_path, 'log',
+            '--skip=%d' % len(previous), '-n', str(limit), '--date=short',
+            '--format=%H%x1f%an%x1f%ad%x1f%s%x1e', '--', path],
+            cwd=self.root_dir)
+        entries = parse_log(proc.run(), ['id', 'author', 'date', 'summary'])
+        for entry in entries:
+            entry['revision'] = entry['id'][0:8]
+        return entries
+
+    def show_revision(self, path, entry):
+        return NonInteractiveProcess([self.git_path, 'show', '--stat', '-p',
+            entry['id'], '--', path], cwd=self.root_dir).run() + '\n'
+
+    # git status doesn't list unmodified files, so the versioned ones are
+    # taken from the index
+    def check_root_status(self):
+        statuses = dict.fromkeys(self.list_tracked(), '')
+        proc = NonInteractiveProcess([self.git_path, 'status', '--porcelain',
+            '-z'], cwd=self.root_dir)
+        statuses.update(parse_git_status(proc.iter_chunks()))
+        return statuses
+
+    def list_tracked(self):
+        repository = self.get_repository()
+        with repository.lock:
+            try:
+                index = repository.get_index()
+                if index != None:
+                    return index.entries.keys() + list(index.conflicts)
+            except (NativeStatusError, IOError, OSError, ValueError,
+                    struct.error):
+                pass
+        proc = NonInteractiveProcess([self.git_path, 'ls-files', '-z'],
+            cwd=self.root_dir)
+        return iter_records(proc.iter_chunks(), '\0')
+
+
+class Hg():
+    def __init__(self, hg_path, root_dir):
+        self.hg_path = hg_path
+        self.root_dir = root_dir
+
+    def run(self, args):
+        if helper_processes.idle_timeout:
+            try:
+                server = helper_processes.get(HgCommandServer, self.hg_path,
+                    self.root_dir)
+                return server.request(args)
+            except (HelperProcessError):
+                pass
+        proc = NonInteractiveProcess([self.hg_path] + args,
+            cwd=self.root_dir)
+        return proc.run()
 
-        proc = NonInteractiveProcess([self.git_path, 'status', '--short'],
+    def iter_chunks(self, args):
+        if helper_processes.idle_timeout:
+            try:
+                server = helper_processes.get(HgCommandServer, self.hg_path,
+                    self.root_dir)
+                return iter([server.request(args, True)])
+            except (HelperProcessError):
+                pass
+        proc = NonInteractiveProcess([self.hg_path] + args,
             cwd=self.root_dir)
-        result = proc.run().strip().split('\n')
-        for line in result:
-            if len(line) < 2:
+        return proc.iter_chunks()
+
+    def check_status(self, path):
+        for status_path, status in parse_hg_status(self.iter_chunks([
+                'status', '-0', path])):
+            return status
+        return ''
+
+    def check_directory_status(self, path):
+        status = get_changes_status(self.check_changes(path).values())
+        # hg files prints errors instead of files when there are none
+        if status == '' and '\0' not in self.run(['files', '-0', path]):
+            return '?'
+        return status
+
+    def check_changes(self, path):
+        return dict(parse_hg_status(self.iter_chunks(['status', '-mard',
+            '-0', path])))
+
+    def check_native_status(self, path, load=True):
+        return None
+
+    def get_base_contents(self, path):
+        node = self.get_base_id(path)
+        if node == None:
+            return None
+        # Contents read through the command server used to lose their line
+        # endings, so they are stored under a new key
+        return blob_cache.get(('hgraw', node), lambda: self.read_base(path))
+
+    def read_base(self, path):
+        return ''.join(self.iter_chunks(['cat', '-r', '.', path]))
+
+    def get_blame_revision(self, path):
+        return self.get_base_id(path)
+
+    def annotate(self, path, start=None, end=None):
+        return parse_hg_blame(self.run(['annotate', '-r', '.', '-u', '-c',
+            '-d', '-T', 'json', path]))
+
+    # hg log can't skip entries, so later pages start below the revision
+    # number of the last entry read
+    def get_log(self, path, previous, limit):
+        args = ['log', '-l', str(limit), '--template',
+            '{rev}\\x1f{node}\\x1f{author|person}\\x1f{date|shortdate}\\x1f' +
+            '{desc|firstline}\\x1e']
+        if previous:
+            if previous[-1]['number'] <= 0:
+                return []
+            args.extend(['-r', '%d:0' % (previous[-1]['number'] - 1)])
+        entries = parse_log(self.run(args + [path]), ['number', 'id',
+            'author', 'date', 'summary'])
+        for entry in entries:
+            entry['number'] = int(entry['number'])
+            entry['revision'] = entry['id'][0:12]
+        return entries
+
+    def show_revision(self, path, entry):
+        return self.run(['log', '-v', '-p', '-r', entry['id'], path]) + '\n'
+
+    # The filelog node of the file in the working copy's parent revision,
+    # from the manifest, which is read again when the dirstate changes
+    def get_base_id(self, path):
+        dirstate = os.path.join(self.root_dir, '.hg', 'dirstate')
+        try:
+            stat = os.stat(dirstate)
+        except (OSError):
+            return None
+        signature = (stat.st_mtime, stat.st_size)
+        cached = hg_manifests.get(self.root_dir)
+        if cached == None or cached[0] != signature:
+            # Lines are "node mode flag path", e.g. "<40 hex> 644   a.txt"
+            manifest = {}
+            for line in self.run(['manifest', '--debug', '-r',
+                    '.']).split('\n'):
+                if len(line) > 47:
+                    manifest[line[47:]] = line[0:40]
+            cached = (signature, manifest)
+            hg_manifests[self.root_dir] = cached
+        relative_path = os.path.relpath(path, self.root_dir).replace(
+            os.sep, '/')
+        return cached[1].get(relative_path)
+
+    # Everything but ignored files, so unmodified files are included
+    def check_root_status(self):
+        return dict(parse_hg_status(self.iter_chunks(['status', '-mardcu',
+            '-0'])))
+
+
+def read_git_varint(data, pos):
+    byte = ord(data[pos])
+    value = byte & 0x7f
+    pos += 1
+    while byte & 0x80:
+        byte = ord(data[pos])
+        value = ((value + 1) << 7) | (byte & 0x7f)
+        pos += 1
+    return (value, pos)
+
+
+def read_file(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def git_blob_sha(data):
+    return hashlib.sha1('blob %d\0' % len(data) + data).hexdigest()
+
+
+def read_git_config(path):
+    config = {}
+    section = None
+    try:
+        lines = read_file(path).split('\n')
+    except (IOError):
+        return config
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        match = re.match(r'^\[\s*([^\]\s"]+)(?:\s+"(.*)")?\s*\]$', line)
+        if match:
+            section = match.group(1).lower()
+            if match.group(2) != None:
+                section += '.' + match.group(2)
+            continue
+        if section != None and '=' in line:
+            key, value = line.split('=', 1)
+            value = value.strip()
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+            config[section + '.' + key.strip().lower()] = value
+    return config
+
+
+# The parsed contents of .git/index. Only stage 0 entries are kept in
+# entries, paths with merge conflicts are kept in conflicts.
+class GitIndex():
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime, stat.st_size)
+        self.mtime = int(stat.st_mtime)
+        self.entries = {}
+        self.conflicts = set()
+        self.parse(read_file(path))
+
+    def parse(self, data):
+        if data[0:4] != 'DIRC':
+            raise NativeStatusError('Invalid git index ' + self.path)
+        version, count = struct.unpack('>II', data[4:12])
+        if version not in [2, 3, 4]:
+            raise NativeStatusError('Unsupported git index version %s' %
+                version)
+
+        pos = 12
+        name = ''
+        for i in xrange(count):
+            fields = struct.unpack('>10I20sH', data[pos:pos + 62])
+            flags = fields[11]
+            extended_flags = 0
+            length = 62
+            if flags & 0x4000:
+                extended_flags = struct.unpack('>H',
+                    data[pos + 62:pos + 64])[0]
+                length = 64
+
+            if version == 4:
+                strip, start = read_git_varint(data, pos + length)
+                end = data.index('\0', start)
+                name = name[:len(name) - strip] + data[start:end]
+                pos = end + 1
+            else:
+                end = data.index('\0', pos + length)
+                name = data[pos + length:end]
+                pos += (length + len(name) + 8) & ~7
+
+            if (flags >> 12) & 3:
+                self.conflicts.add(name)
+                continue
+            # (mtime seconds, mtime nanoseconds, size, mode, sha, flags)
+            self.entries[name] = (fields[2], fields[3], fields[9],
+                fields[6], fields[10].encode('hex'), extended_flags)
+
+        # Split and sparse indexes don't list every file themselves
+        while pos + 8 <= len(data) - 20:
+            extension, size = struct.unpack('>4sI', data[pos:pos + 8])
+            if extension in ['link', 'sdir']:
+                raise NativeStatusError('Unsupported git index extension ' +
+                    extension)
+            pos += 8 + size
+
+
+class GitPackIndex():
+    def __init__(self, path):
+        self.path = path
+        self.pack_path = path[:-4] + '.pack'
+        self.data = read_file(path)
+        if self.data[0:8] != '\377tOc\0\0\0\2':
+            raise NativeStatusError('Unsupported git pack index ' + path)
+        self.fanout = struct.unpack('>256I', self.data[8:1032])
+        self.count = self.fanout[255]
+
+    def find(self, sha):
+        first = ord(sha[0])
+        low = self.fanout[first - 1] if first else 0
+        high = self.fanout[first]
+        while low < high:
+            middle = (low + high) // 2
+            pos = 1032 + middle * 20
+            current = self.data[pos:pos + 20]
+            if current == sha:
+                return self.get_offset(middle)
+            if current < sha:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get_offset(self, index):
+        pos = 1032 + self.count * 24 + index * 4
+        offset = struct.unpack('>I', self.data[pos:pos + 4])[0]
+        if offset & 0x80000000:
+            pos = 1032 + self.count * 28 + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', self.data[pos:pos + 8])[0]
+        return offset
+
+
+# Reads loose and packed objects from the object database of a repository
+# and its alternates
+class GitObjectStore():
+    types = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+
+    def __init__(self, objects_dir, git_path=None, root_dir=None):
+        self.git_path = git_path
+        self.root_dir = root_dir
+        self.objects_dirs = [objects_dir]
+        alternates = os.path.join(objects_dir, 'info', 'alternates')
+        if os.path.exists(alternates):
+            for line in read_file(alternates).split('\n'):
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    self.objects_dirs.append(os.path.join(objects_dir, line))
+        self.packs = None
+        self.trees = {}
+
+    def load_packs(self):
+        self.packs = []
+        for objects_dir in self.objects_dirs:
+            pack_dir = os.path.join(objects_dir, 'pack')
+            if not os.path.isdir(pack_dir):
                 continue
-            path_without_root = path.replace(self.root_dir + '\\', '', 1)
-            path_regex = re.escape(path_without_root) + '$'
-            if self.root_dir != path and re.search(path_regex, line) == None:
+            for name in os.listdir(pack_dir):
+                if not name.endswith('.idx'):
+                    continue
+                try:
+                    self.packs.append(GitPackIndex(os.path.join(pack_dir,
+                        name)))
+                except (NativeStatusError):
+                    pass
+
+    def read_object(self, sha):
+        for objects_dir in self.objects_dirs:
+            path = os.path.join(objects_dir, sha[0:2], sha[2:])
+            if os.path.exists(path):
+                data = zlib.decompress(read_file(path))
+                header, data = data.split('\0', 1)
+                return (header.split(' ')[0], data)
+
+        # New packs appear after a fetch or gc, so look again before failing
+        for reload in [False, True]:
+            if self.packs == None or reload:
+                self.load_packs()
+            for pack in self.packs:
+                offset = pack.find(sha.decode('hex'))
+                if offset != None:
+                    f = open(pack.pack_path, 'rb')
+                    try:
+                        return self.read_pack_object(f, offset)
+                    finally:
+                        f.close()
+
+        # Objects of partial clones and unsupported pack formats are
+        # requested from a long-running git cat-file
+        if self.git_path != None and helper_processes.idle_timeout:
+            try:
+                return helper_processes.get(GitCatFile, self.git_path,
+                    self.root_dir).request(sha)
+            except (HelperProcessError):
+                pass
+        raise NativeStatusError('Unable to find git object ' + sha)
+
+    def read_pack_object(self, f, offset):
+        f.seek(offset)
+        byte = ord(f.read(1))
+        type = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = ord(f.read(1))
+            size |= (byte & 0x7f) << shift
+            shift += 7
+
+        base = None
+        if type == 6:
+            byte = ord(f.read(1))
+            base_offset = byte & 0x7f
+            while byte & 0x80:
+                byte = ord(f.read(1))
+                base_offset = ((base_offset + 1) << 7) | (byte & 0x7f)
+            base = ('offset', offset - base_offset)
+        elif type == 7:
+            base = ('sha', f.read(20).encode('hex'))
+
+        decompressor = zlib.decompressobj()
+        chunks = []
+        length = 0
+        while length < size:
+            chunk = f.read(8192)
+            if not chunk:
+                break
+            chunk = decompressor.decompress(chunk)
+            chunks.append(chunk)
+            length += len(chunk)
+        data = ''.join(chunks)
+
+        if base == None:
+            return (self.types[type], data)
+        if base[0] == 'offset':
+            base_type, base_data = self.read_pack_object(f, base[1])
+        else:
+            base_type, base_data = self.read_object(base[1])
+        return (base_type, apply_git_delta(base_data, data))
+
+    def read_tree(self, sha):
+        if sha in self.trees:
+            return self.trees[sha]
+        type, data = self.read_object(sha)
+        if type != 'tree':
+            raise NativeStatusError('Git object ' + sha + ' is not a tree')
+        tree = {}
+        pos = 0
+        while pos < len(data):
+            space = data.index(' ', pos)
+            nul = data.index('\0', space)
+            tree[data[space + 1:nul]] = (data[pos:space],
+                data[nul + 1:nul + 21].encode('hex'))
+            pos = nul + 21
+        if len(self.trees) > 1000:
+            self.trees.clear()
+        self.trees[sha] = tree
+        return tree
+
+    # The (mode, sha) tree entry of a file, or None if it isn't in the tree
+    def find_entry(self, tree_sha, path):
+        parts = path.split('/')
+        for part in parts[:-1]:
+            entry = self.read_tree(tree_sha).get(part)
+            if entry == None or entry[0] != '40000':
+                return None
+            tree_sha = entry[1]
+        entry = self.read_tree(tree_sha).get(parts[-1])
+        if entry == None or entry[0] == '40000':
+            return None
+        return entry
+
+
+def apply_git_delta(base, delta):
+    pos = 0
+    for i in range(2):
+        byte = 0x80
+        while byte & 0x80:
+            byte = ord(delta[pos])
+            pos += 1
+
+    result = []
+    while pos < len(delta):
+        op = ord(delta[pos])
+        pos += 1
+        if op & 0x80:
+            offset = 0
+            size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= ord(delta[pos]) << (i * 8)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= ord(delta[pos]) << (i * 8)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            result.append(base[offset:offset + size])
+        elif op:
+            result.append(delta[pos:pos + op])
+            pos += op
+        else:
+            raise NativeStatusError('Invalid git delta')
+    return ''.join(result)
+
+
+# Evaluates .gitignore, .git/info/exclude and core.excludesFile patterns.
+# Sources are checked from lowest to highest precedence, so the last
+# matching pattern decides.
+class GitIgnore():
+    def __init__(self, root_dir, git_dir):
+        self.root_dir = root_dir
+        self.files = {}
+
+        self.global_sources = []
+        config = read_git_config(os.path.expanduser('~/.gitconfig'))
+        config.update(read_git_config(os.path.join(git_dir, 'config')))
+        excludes_file = config.get('core.excludesfile')
+        if excludes_file == None:
+            xdg_home = os.environ.get('XDG_CONFIG_HOME',
+                os.path.expanduser('~/.config'))
+            excludes_file = os.path.join(xdg_home, 'git', 'ignore')
+        self.global_sources.append(os.path.expanduser(excludes_file))
+        self.global_sources.append(os.path.join(git_dir, 'info', 'exclude'))
+
+    def is_ignored(self, path, is_dir=False):
+        parts = path.split('/')
+        for i in range(1, len(parts) + 1):
+            if self.matches('/'.join(parts[:i]), i < len(parts) or is_dir):
+                return True
+        return False
+
+    def matches(self, path, is_dir):
+        sources = [('', source) for source in self.global_sources]
+        base = ''
+        sources.append((base, os.path.join(self.root_dir, '.gitignore')))
+        for part in path.split('/')[:-1]:
+            base += part + '/'
+            sources.append((base, os.path.join(self.root_dir, base,
+                '.gitignore')))
+
+        ignored = False
+        for base, source in sources:
+            relative_path = path[len(base):]
+            for negate, dir_only, regex in self.read_patterns(source):
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(relative_path):
+                    ignored = not negate
+        return ignored
+
+    def read_patterns(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except (OSError):
+            return []
+        if path in self.files and self.files[path][0] == mtime:
+            return self.files[path][1]
+
+        patterns = []
+        for line in read_file(path).split('\n'):
+            line = line.rstrip('\r').rstrip(' ')
+            if not line or line.startswith('#'):
                 continue
+            negate = line.startswith('!')
+            if negate or line.startswith('\\'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            regex = self.translate(line.lstrip('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            patterns.append((negate, dir_only, re.compile(regex + '$')))
+        self.files[path] = (mtime, patterns)
+        return patterns
 
-            if line[0] != ' ':
-                res = line[0]
+    def translate(self, pattern):
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            at_start = i == 0 or pattern[i - 1] == '/'
+            if at_start and pattern.startswith('**/', i):
+                regex += '(?:.*/)?'
+                i += 3
+                continue
+            if at_start and pattern[i:] == '**':
+                regex += '.*'
+                i += 2
+                continue
+            char = pattern[i]
+            i += 1
+            if char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[' and ']' in pattern[i + 1:]:
+                end = pattern.index(']', i + 1)
+                group = pattern[i:end].replace('\\', '\\\\')
+                if group.startswith('!'):
+                    group = '^' + group[1:]
+                regex += '[' + group + ']'
+                i = end + 1
+            elif char == '\\' and i < len(pattern):
+                regex += re.escape(pattern[i])
+                i += 1
             else:
-                res = line[1]
-            return res.upper()
-        return ''
+                regex += re.escape(char)
+        return regex
 
 
-class Hg():
-    def __init__(self, tortoise_proc_path, root_dir):
-        self.hg_path = os.path.dirname(tortoise_proc_path) + '\\hg.exe'
+# Answers file statuses from .git/index, the HEAD tree and the working
+# tree without running git. get_status() returns None whenever the answer
+# can't be determined reliably, e.g. because of clean/smudge filters, so
+# the caller can fall back to git itself.
+class GitRepository():
+    def __init__(self, root_dir, git_path=None):
+        self.root_dir = root_dir
+        self.git_dir = find_git_dir(root_dir)
+        self.common_dir = self.git_dir
+        commondir_file = os.path.join(self.git_dir, 'commondir')
+        if os.path.exists(commondir_file):
+            self.common_dir = os.path.normpath(os.path.join(self.git_dir,
+                read_file(commondir_file).strip()))
+        self.objects = GitObjectStore(os.path.join(self.common_dir,
+            'objects'), git_path, root_dir)
+        self.ignore = GitIgnore(root_dir, self.git_dir)
+        config = read_git_config(os.path.join(self.common_dir, 'config'))
+        filemode = config.get('core.filemode',
+            'false' if os.name == 'nt' else 'true')
+        self.filemode = filemode.lower() in ['true', 'yes', 'on', '1']
+        self.index = None
+        self.lock = threading.Lock()
+
+    def get_index(self, load=True):
+        path = os.path.join(self.git_dir, 'index')
+        try:
+            stat = os.stat(path)
+        except (OSError):
+            return None
+        index = self.index
+        if index != None and index.signature == (stat.st_mtime,
+                stat.st_size):
+            return index
+        if not load:
+            return None
+        index = GitIndex(path)
+        self.index = index
+        return index
+
+    def get_head_commit(self):
+        head = read_file(os.path.join(self.git_dir, 'HEAD')).strip()
+        if head.startswith('ref:'):
+            return self.resolve_ref(head[4:].strip())
+        return head
+
+    def get_head_tree(self):
+        head = self.get_head_commit()
+        if head == None:
+            return None
+        type, data = self.objects.read_object(head)
+        if type != 'commit' or not data.startswith('tree '):
+            raise NativeStatusError('Unable to read git commit ' + head)
+        return data[5:45]
+
+    def resolve_ref(self, ref):
+        for dir in [self.git_dir, self.common_dir]:
+            path = os.path.join(dir, *ref.split('/'))
+            if os.path.isfile(path):
+                return read_file(path).strip()
+        path = os.path.join(self.common_dir, 'packed-refs')
+        if os.path.exists(path):
+            for line in read_file(path).split('\n'):
+                parts = line.strip().split(' ')
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+        # An unborn branch, i.e. a repository without commits
+        return None
+
+    def get_status(self, path, load=True):
+        with self.lock:
+            try:
+                return self.check_status(path, load)
+            except (NativeStatusError, IOError, OSError, ValueError,
+                    KeyError, IndexError, zlib.error, struct.error):
+                return None
+
+    def check_status(self, path, load):
+        index = self.get_index(load)
+        if index == None:
+            return None
+        relative_path = os.path.relpath(path, self.root_dir).replace(
+            os.sep, '/')
+        if relative_path in index.conflicts:
+            return 'U'
+
+        head_tree = self.get_head_tree()
+        head_entry = None
+        if head_tree != None:
+            head_entry = self.objects.find_entry(head_tree, relative_path)
+
+        entry = index.entries.get(relative_path)
+        if entry == None:
+            if head_entry != None:
+                return 'D'
+            if self.ignore.is_ignored(relative_path):
+                return ''
+            return '?'
+
+        mtime, mtime_ns, size, mode, sha, extended_flags = entry
+        if extended_flags & 0x2000:
+            return 'A'
+        if head_entry == None:
+            # A staged file may be the target of git mv, which git reports
+            # as a rename, so only answer for repositories without commits
+            if head_tree != None:
+                return None
+            return 'A'
+        if head_entry[1] != sha or int(head_entry[0], 8) != mode:
+            return 'M'
+        if extended_flags & 0x4000 or mode == 0160000:
+            return ''
+        return self.check_worktree(path, entry, index)
+
+    # The blob sha of the file as staged in the index, which is what git
+    # diff compares the working tree against
+    def get_base_id(self, path):
+        relative_path = os.path.relpath(path, self.root_dir).replace(
+            os.sep, '/')
+        with self.lock:
+            try:
+                index = self.get_index()
+            except (NativeStatusError, IOError, OSError, ValueError,
+                    IndexError, struct.error):
+                return None
+        if index == None or relative_path not in index.entries:
+            return None
+        return index.entries[relative_path][4]
+
+    def read_blob(self, sha):
+        with self.lock:
+            try:
+                type, data = self.objects.read_object(sha)
+            except (NativeStatusError, IOError, OSError, ValueError,
+                    KeyError, IndexError, zlib.error, struct.error):
+                return None
+        return data if type == 'blob' else None
+
+    def check_worktree(self, path, entry, index):
+        mtime, mtime_ns, size, mode, sha, extended_flags = entry
+        try:
+            stat = os.lstat(path)
+        except (OSError):
+            return 'D'
+
+        # chmod +x changes the file without touching its contents
+        if self.filemode and mode & 0170000 == 0100000 and \
+                bool(mode & 0111) != bool(stat.st_mode & 0111):
+            return 'M'
+
+        # Files changed in the same second the index was written are
+        # "racily clean" and have to be compared by content
+        stat_ns = int(round((stat.st_mtime - int(stat.st_mtime)) * 1e9))
+        if int(stat.st_mtime) == mtime and stat.st_size & 0xffffffff == \
+                size and (mtime_ns == 0 or abs(stat_ns - mtime_ns) < 1000) \
+                and mtime < index.mtime:
+            return ''
+
+        if os.path.islink(path):
+            data = os.readlink(path)
+        else:
+            data = read_file(path)
+        if git_blob_sha(data) == sha:
+            return ''
+
+        # Line ending conversion and filters make the working copy differ
+        # from the blob without it being modified, so let git decide
+        if '\r\n' in data and git_blob_sha(data.replace('\r\n', '\n')) == sha:
+            return None
+        if self.has_attributes(path):
+            return None
+        return 'M'
+
+    def has_attributes(self, path):
+        if os.path.exists(os.path.join(self.git_dir, 'info', 'attributes')):
+            return True
+        dir = os.path.dirname(path)
+        while True:
+            if os.path.exists(os.path.join(dir, '.gitattributes')):
+                return True
+            if os.path.normcase(dir) == os.path.normcase(self.root_dir):
+                return False
+            parent = os.path.dirname(dir)
+            if parent == dir:
+                return False
+            dir = parent
+
+
+def parse_svn_skel(data):
+    stack = [[]]
+    pos = 0
+    while pos < len(data):
+        char = data[pos]
+        if char == '(':
+            stack.append([])
+            pos += 1
+        elif char == ')':
+            item = stack.pop()
+            stack[-1].append(item)
+            pos += 1
+        elif char.isspace():
+            pos += 1
+        elif char.isdigit():
+            end = pos
+            while data[end].isdigit():
+                end += 1
+            start = end + 1
+            length = int(data[pos:end])
+            stack[-1].append(data[start:start + length])
+            pos = start + length
+        else:
+            end = pos
+            while end < len(data) and not data[end].isspace() and \
+                    data[end] not in '()':
+                end += 1
+            stack[-1].append(data[pos:end])
+            pos = end
+    return stack[0]
+
+
+def parse_svn_properties(data):
+    if not data:
+        return {}
+    items = parse_svn_skel(str(data))
+    if not items:
+        return {}
+    items = items[0]
+    return dict(zip(items[0::2], items[1::2]))
+
+
+def read_svn_global_ignores():
+    ignores = '*.o *.lo *.la *.al .libs *.so *.so.[0-9]* *.a *.pyc *.pyo ' + \
+        '__pycache__ *.rej *~ #*# .#* .*.swp .DS_Store'
+    if os.name == 'nt':
+        config_dir = os.path.join(os.environ.get('APPDATA', ''), 'Subversion')
+    else:
+        config_dir = os.path.expanduser('~/.subversion')
+
+    section = None
+    try:
+        f = open(os.path.join(config_dir, 'config'), 'r')
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+    except (IOError):
+        lines = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('['):
+            section = line.strip('[]').strip()
+        elif section == 'miscellany' and line.startswith('global-ignores'):
+            ignores = line.split('=', 1)[1]
+    return ignores.split()
+
+
+# The versioned state of an SVN 1.7+ working copy, loaded from .svn/wc.db
+# with a single query and reloaded whenever wc.db changes. Only SELECT
+# statements are run against the database.
+class SVNWorkingCopy():
+    def __init__(self, root_dir):
         self.root_dir = root_dir
+        self.db_path = os.path.join(root_dir, '.svn', 'wc.db')
+        self.signature = None
+        self.nodes = {}
+        self.conflicts = set()
+        self.modified_properties = {}
+        self.global_ignores = read_svn_global_ignores()
+        self.lock = threading.Lock()
+
+    def load(self):
+        stat = os.stat(self.db_path)
+        signature = (stat.st_mtime, stat.st_size)
+        if signature == self.signature:
+            return
+
+        connection = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT id FROM WCROOT WHERE local_abspath ' +
+                'IS NULL OR local_abspath = ?', (self.root_dir,))
+            row = cursor.fetchone()
+            if row == None:
+                raise NativeStatusError('Unable to find the SVN working ' +
+                    'copy root in ' + self.db_path)
+            wc_id = row[0]
+
+            # For each path only the row with the highest op_depth is the
+            # current state, but an op_depth 0 row means it was replaced
+            nodes = {}
+            cursor.execute('SELECT local_relpath, op_depth, presence, ' +
+                'kind, checksum, translated_size, last_mod_time, ' +
+                'properties FROM NODES WHERE wc_id = ? ORDER BY ' +
+                'local_relpath, op_depth', (wc_id,))
+            for row in cursor:
+                relpath = row[0]
+                has_base = relpath in nodes and nodes[relpath]['has_base']
+                nodes[relpath] = {
+                    'op_depth': row[1],
+                    'presence': row[2],
+                    'kind': row[3],
+                    'checksum': row[4],
+                    'translated_size': row[5],
+                    'last_mod_time': row[6],
+                    'properties': row[7],
+                    'has_base': has_base or (row[1] == 0 and
+                        row[2] == 'normal')
+                }
+
+            # SVN 1.7 stores conflicts in separate columns, 1.8+ in a skel
+            cursor.execute('PRAGMA table_info(ACTUAL_NODE)')
+            columns = [column[1] for column in cursor.fetchall()]
+            conflict_columns = [column for column in ['conflict_old',
+                'conflict_new', 'conflict_working', 'prop_reject',
+                'tree_conflict_data', 'conflict_data'] if column in columns]
+            conflicts = set()
+            modified_properties = {}
+            cursor.execute('SELECT local_relpath, properties, ' +
+                ', '.join(conflict_columns) + ' FROM ACTUAL_NODE WHERE ' +
+                'wc_id = ?', (wc_id,))
+            for row in cursor:
+                if row[1] != None:
+                    modified_properties[row[0]] = row[1]
+                for value in row[2:]:
+                    if value != None:
+                        conflicts.add(row[0])
+        finally:
+            connection.close()
+
+        self.nodes = nodes
+        self.conflicts = conflicts
+        self.modified_properties = modified_properties
+        self.signature = signature
+
+    def is_loaded(self):
+        try:
+            stat = os.stat(self.db_path)
+        except (OSError):
+            return False
+        return self.signature == (stat.st_mtime, stat.st_size)
+
+    def get_status(self, path, load=True):
+        with self.lock:
+            try:
+                if not load and not self.is_loaded():
+                    return None
+                self.load()
+                return self.check_status(path)
+            except (NativeStatusError, sqlite3.Error, IOError, OSError,
+                    ValueError, IndexError):
+                return None
 
     def check_status(self, path):
-        if os.path.isdir(path):
-            proc = NonInteractiveProcess([self.hg_path, 'log', '-l', '1',
-                '"' + path + '"'], cwd=self.root_dir)
-            result = proc.run().strip().split('\n')
-            if result == ['']:
-                return '?'
+        relpath = os.path.relpath(path, self.root_dir).replace(os.sep, '/')
+        if relpath in self.conflicts:
+            return 'C'
+
+        node = self.nodes.get(relpath)
+        if node == None:
+            if self.is_ignored(relpath):
+                return ''
+            return '?'
+
+        # A row's op_depth is the depth of the add, copy or delete it belongs
+        # to. Below the root of a copy, nodes are unmodified copies like svn
+        # status shows them, and are compared with the copied pristine.
+        presence = node['presence']
+        if node['op_depth'] > 0:
+            if presence == 'base-deleted':
+                return 'D'
+            if presence != 'normal':
+                return None
+            if node['op_depth'] == relpath.count('/') + 1:
+                return 'R' if node['has_base'] else 'A'
+        elif presence == 'incomplete':
+            return '!'
+        if presence != 'normal':
+            return None
+
+        if node['kind'] != 'file':
+            return None
+        status = self.check_text(path, node)
+        if status == '' and relpath in self.modified_properties:
+            return 'M'
+        return status
+
+    def check_text(self, path, node):
+        try:
+            stat = os.stat(path)
+        except (OSError):
+            return '!'
+
+        if node['translated_size'] == stat.st_size and \
+                node['last_mod_time'] != None and \
+                abs(node['last_mod_time'] - int(stat.st_mtime * 1000000)) < 2:
             return ''
 
-        proc = NonInteractiveProcess([self.hg_path, 'status', path],
-            cwd=self.root_dir)
-        result = proc.run().split('\n')
-        for line in result:
-            if len(line) < 1:
+        # Keyword expansion and line ending conversion make the working file
+        # differ from the pristine copy, so let svn decide
+        properties = parse_svn_properties(node['properties'])
+        if 'svn:keywords' in properties or 'svn:eol-style' in properties or \
+                'svn:special' in properties:
+            return None
+
+        checksum = node['checksum']
+        if not checksum or not checksum.startswith('$sha1$'):
+            return None
+        checksum = checksum[6:]
+        pristine = self.get_pristine_path(checksum)
+        if stat.st_size != os.path.getsize(pristine):
+            return 'M'
+        if hashlib.sha1(read_file(path)).hexdigest() == checksum:
+            return ''
+        return 'M'
+
+    def get_pristine_path(self, checksum):
+        return os.path.join(self.root_dir, '.svn', 'pristine', checksum[0:2],
+            checksum + '.svn-base')
+
+    # The sha1 of the file's BASE revision in the pristine store
+    def get_base_id(self, path):
+        relpath = os.path.relpath(path, self.root_dir).replace(os.sep, '/')
+        with self.lock:
+            try:
+                self.load()
+            except (NativeStatusError, sqlite3.Error, IOError, OSError,
+                    ValueError, IndexError):
+                return None
+            node = self.nodes.get(relpath)
+        if node == None or node['presence'] != 'normal' or \
+                node['kind'] != 'file':
+            return None
+        checksum = node['checksum']
+        if not checksum or not checksum.startswith('$sha1$'):
+            return None
+        return checksum[6:]
+
+    # The pristine store already is content addressed, so large files are
+    # read from it rather than copied into the blob cache's store.
+    # Keywords in pristine files are unexpanded.
+    def read_pristine(self, checksum):
+        try:
+            return read_file(self.get_pristine_path(checksum))
+        except (IOError, OSError):
+            return None
+
+    def is_ignored(self, relpath):
+        parts = relpath.split('/')
+        for i in range(len(parts)):
+            parent = '/'.join(parts[:i])
+            name = parts[i]
+            if '/'.join(parts[:i + 1]) in self.nodes:
                 continue
-            return line[0].upper()
-        return ''
\ No newline at end of file
+
+            patterns = list(self.global_ignores)
+            parent_node = self.nodes.get(parent)
+            if parent_node != None:
+                properties = self.modified_properties.get(parent,
+                    parent_node['properties'])
+                ignores = parse_svn_properties(properties).get('svn:ignore',
+                    '')
+                patterns.extend(ignores.split())
+            for pattern in patterns:
+                if fnmatch.fnmatchcase(name, pattern):
+                    return True
+            return False
+        return False
+
+
+def get_cache_dir(settings):
+    if not settings.get('persistent_cache', True):
+        return None
+    return os.path.join(os.path.dirname(sublime.packages_path()), 'Cache',
+        'Tortoise')
+
+
+# Configures the caches, helper processes and process guard shared by all
+# working copies. Runs when the plugin loads and whenever the settings
+# change.
+def apply_settings():
+    settings = sublime.load_settings('Tortoise.sublime-settings')
+    status_cache.max_size = settings.get('cache_max_entries', 250000)
+    helper_processes.idle_timeout = settings.get('helper_idle_timeout', 300)
+    blob_cache.memory.max_size = settings.get('blob_cache_size',
+        64) * 1048576
+    blob_cache.store_size = settings.get('blob_store_size', 256) * 1048576
+    cache_dir = get_cache_dir(settings)
+    blob_cache.store_dir = None
+    if cache_dir:
+        blob_cache.store_dir = os.path.join(cache_dir, 'blobs')
+    process_guard.timeout = settings.get('process_timeout', 30)
+    process_guard.max_timeouts = settings.get('circuit_breaker_timeouts', 3)
+    process_guard.cooldown = settings.get('circuit_breaker_cooldown', 300)
+    process_guard.large_seconds = settings.get('large_repository_seconds', 5)
+    process_guard.large_files = settings.get('large_repository_files',
+        200000)
+
+
+sublime.load_settings('Tortoise.sublime-settings').add_on_change('tortoise',
+    apply_settings)
+apply_settings()
\ No newline at end of file
@@ -0,0 +1,385 @@
+# Measures how long the status lookups behind the Tortoise menus take, using
+# generated Git, Mercurial and SVN working copies and the stand-in sublime
+# modules in this folder. Run it with Python 2, e.g.
+#
+#   python bench/benchmark.py --files 5000 --vcs git,hg --json results.json
+#
+# Only the VCSs whose command line clients are found are benchmarked.
+
+import sys
+import os
+import os.path
+import time
+import timeit
+import random
+import shutil
+import stat
+import tempfile
+import subprocess
+import optparse
+from distutils.spawn import find_executable
+
+try:
+    import json
+except (ImportError):
+    json = None
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, bench_dir)
+sys.path.insert(1, os.path.dirname(bench_dir))
+
+import sublime
+import Tortoise
+
+
+def parse_options():
+    parser = optparse.OptionParser()
+    parser.add_option('--vcs', default='git,hg,svn',
+        help='comma separated VCSs to benchmark [%default]')
+    parser.add_option('--files', type='int', default=2000,
+        help='number of versioned files [%default]')
+    parser.add_option('--depth', type='int', default=4,
+        help='maximum folder depth [%default]')
+    parser.add_option('--width', type='int', default=8,
+        help='folders per level [%default]')
+    parser.add_option('--untracked', type='float', default=0.05,
+        help='ratio of unversioned files to add [%default]')
+    parser.add_option('--modified', type='float', default=0.05,
+        help='ratio of versioned files to modify [%default]')
+    parser.add_option('--iterations', type='int', default=30,
+        help='samples per measurement [%default]')
+    parser.add_option('--seed', type='int', default=1,
+        help='random seed for the generated working copies [%default]')
+    parser.add_option('--dir', help='where to generate the working ' +
+        'copies, a temporary folder by default')
+    parser.add_option('--keep', action='store_true',
+        help='keep the generated working copies')
+    parser.add_option('--native', default='true', choices=['true', 'false'],
+        help='the native_status setting [%default]')
+    parser.add_option('--helper-idle-timeout', type='int', default=300,
+        help='the helper_idle_timeout setting [%default]')
+    parser.add_option('--json', help='also write the results to this file')
+    options, args = parser.parse_args()
+    return options
+
+
+def run(args, cwd):
+    devnull = open(os.devnull, 'w')
+    try:
+        subprocess.check_call(args, cwd=cwd, stdout=devnull,
+            stderr=subprocess.STDOUT)
+    finally:
+        devnull.close()
+
+
+def write_file(path, lines):
+    dir = os.path.dirname(path)
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    f = open(path, 'wb')
+    try:
+        f.write('\n'.join(lines) + '\n')
+    finally:
+        f.close()
+
+
+def random_dir(root_dir, options, rand):
+    parts = []
+    for level in range(rand.randint(0, options.depth)):
+        parts.append('dir%d' % rand.randint(0, options.width - 1))
+    return os.path.join(root_dir, *parts)
+
+
+def generate_files(root_dir, options, rand):
+    paths = []
+    for i in range(options.files):
+        path = os.path.join(random_dir(root_dir, options, rand),
+            'file%d.txt' % i)
+        write_file(path, ['line %d of %s' % (n, i) for n in range(20)])
+        paths.append(path)
+    return paths
+
+
+# Modifies and adds files once the initial commit exists
+def change_files(root_dir, paths, options, rand):
+    modified = rand.sample(paths, int(len(paths) * options.modified))
+    for path in modified:
+        f = open(path, 'ab')
+        f.write('modified\n')
+        f.close()
+
+    untracked = []
+    for i in range(int(len(paths) * options.untracked)):
+        path = os.path.join(random_dir(root_dir, options, rand),
+            'untracked%d.txt' % i)
+        write_file(path, ['untracked'])
+        untracked.append(path)
+    return untracked
+
+
+def create_git(work_dir, executable):
+    root_dir = os.path.join(work_dir, 'git')
+    os.makedirs(root_dir)
+    run([executable, 'init', '-q'], root_dir)
+    return root_dir
+
+
+def commit_git(root_dir, executable):
+    run([executable, 'add', '.'], root_dir)
+    run([executable, '-c', 'user.name=bench', '-c',
+        'user.email=bench@example.com', 'commit', '-q', '-m', 'initial'],
+        root_dir)
+
+
+def create_hg(work_dir, executable):
+    root_dir = os.path.join(work_dir, 'hg')
+    os.makedirs(root_dir)
+    run([executable, 'init'], root_dir)
+    return root_dir
+
+
+def commit_hg(root_dir, executable):
+    run([executable, 'add', '-q'], root_dir)
+    run([executable, 'commit', '-q', '-u', 'bench', '-m', 'initial'],
+        root_dir)
+
+
+def create_svn(work_dir, executable):
+    repository = os.path.join(work_dir, 'svn-repository')
+    run([os.path.join(os.path.dirname(executable), 'svnadmin'), 'create',
+        repository], work_dir)
+    url = 'file:///' + repository.replace('\\', '/').lstrip('/')
+    root_dir = os.path.join(work_dir, 'svn')
+    run([executable, 'checkout', '-q', url, root_dir], work_dir)
+    return root_dir
+
+
+def commit_svn(root_dir, executable):
+    run([executable, 'add', '-q', '--force', '.'], root_dir)
+    run([executable, 'commit', '-q', '-m', 'initial'], root_dir)
+    run([executable, 'update', '-q'], root_dir)
+
+
+backends = {
+    'git': ('git', create_git, commit_git, 'git_path'),
+    'hg': ('hg', create_hg, commit_hg, 'hg_path'),
+    'svn': ('svn', create_svn, commit_svn, 'svn_path')
+}
+
+
+def stop_helpers():
+    for helper in Tortoise.helper_processes.helpers.values():
+        helper.lock.acquire()
+        try:
+            helper.stop()
+        finally:
+            helper.lock.release()
+
+
+def wait_for_worker():
+    while Tortoise.status_worker.pending:
+        time.sleep(0.005)
+
+
+def reset_caches():
+    wait_for_worker()
+    Tortoise.vcs_cache.clear()
+    Tortoise.status_cache.clear()
+    Tortoise.git_repositories.clear()
+    Tortoise.svn_working_copies.clear()
+    Tortoise.status_memo.clear()
+
+
+class View():
+    def __init__(self, path):
+        self.path = path
+
+    def file_name(self):
+        return self.path
+
+
+class Window():
+    def __init__(self, path):
+        self.view = View(path)
+
+    def active_view(self):
+        return self.view
+
+
+def load_menu_commands():
+    menu = open(os.path.join(sublime.package_dir, 'Side Bar.sublime-menu'))
+    try:
+        items = json.loads(menu.read())
+    finally:
+        menu.close()
+    commands = []
+    for item in items:
+        if 'command' in item:
+            name = ''.join([part.capitalize() for part in
+                item['command'].split('_')]) + 'Command'
+            commands.append(getattr(Tortoise, name))
+    return commands
+
+
+# What Sublime does on the UI thread to show the side bar menu for a path
+def render_menu(commands, path):
+    window = Window(path)
+    for cls in commands:
+        command = cls(window)
+        command.is_visible(paths=[path])
+        command.is_enabled(paths=[path])
+
+
+def measure(iterations, function, samples, setup=None):
+    timings = []
+    for i in range(iterations):
+        if setup != None:
+            setup()
+        sample = samples[i % len(samples)]
+        start = timeit.default_timer()
+        function(sample)
+        timings.append(timeit.default_timer() - start)
+    return timings
+
+
+def percentile(timings, percent):
+    timings = sorted(timings)
+    index = int(round(percent / 100.0 * len(timings) + 0.5)) - 1
+    return timings[max(0, min(index, len(timings) - 1))]
+
+
+def summarize(timings):
+    return {
+        'count': len(timings),
+        'mean': sum(timings) / len(timings),
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'max': max(timings)
+    }
+
+
+def benchmark(root_dir, files, dirs, options):
+    command = Tortoise.TortoiseCommand()
+    commands = load_menu_commands()
+    iterations = options.iterations
+
+    def get_vcs(path):
+        return command.get_vcs(path)
+
+    def get_status(path):
+        return command.get_vcs(path).get_status(path)
+
+    def get_menu(path):
+        render_menu(commands, path)
+
+    def clear_vcs_cache():
+        Tortoise.vcs_cache.clear()
+
+    def cold():
+        reset_caches()
+        stop_helpers()
+
+    results = []
+    results.append(('resolve working copy (cold)',
+        measure(iterations, get_vcs, files, clear_vcs_cache)))
+    results.append(('resolve working copy (warm)',
+        measure(iterations, get_vcs, files)))
+    results.append(('file status (cold)',
+        measure(iterations, get_status, files, cold)))
+    results.append(('file status (warm)',
+        measure(iterations, get_status, files)))
+    results.append(('folder status (cold)',
+        measure(iterations, get_status, dirs, cold)))
+    results.append(('folder status (warm)',
+        measure(iterations, get_status, dirs)))
+    results.append(('menu render (cold)',
+        measure(iterations, get_menu, files, cold)))
+    # Every time a menu is opened is a new render
+    results.append(('menu render (warm)',
+        measure(iterations, get_menu, files, Tortoise.status_memo.clear)))
+    wait_for_worker()
+    return [(name, summarize(timings)) for name, timings in results]
+
+
+def print_results(vcs, file_count, results):
+    print '%s, %d files' % (vcs, file_count)
+    print '  %-30s %6s %9s %9s %9s %9s %9s' % ('milliseconds', 'n', 'mean',
+        'p50', 'p90', 'p99', 'max')
+    for name, summary in results:
+        print '  %-30s %6d %9.2f %9.2f %9.2f %9.2f %9.2f' % (name,
+            summary['count'], summary['mean'] * 1000, summary['p50'] * 1000,
+            summary['p90'] * 1000, summary['p99'] * 1000,
+            summary['max'] * 1000)
+    print
+
+
+def remove_tree(path):
+    # Git makes its objects read only, which Windows refuses to delete
+    def make_writable(function, path, exc_info):
+        os.chmod(path, stat.S_IWRITE)
+        function(path)
+    shutil.rmtree(path, onerror=make_writable)
+
+
+def main():
+    options = parse_options()
+    if json == None:
+        print 'The benchmark needs Python 2.6 or newer'
+        return 1
+
+    sublime.overrides.update({
+        'native_status': options.native == 'true',
+        'helper_idle_timeout': options.helper_idle_timeout,
+        'prefetch_status': False,
+        'persistent_cache': False,
+        'debug': False
+    })
+    Tortoise.apply_settings()
+
+    work_dir = options.dir or tempfile.mkdtemp(prefix='tortoise-bench-')
+    report = {}
+    try:
+        for vcs in options.vcs.split(','):
+            name, create, commit, setting_name = backends[vcs]
+            executable = find_executable(name)
+            if executable == None:
+                print 'Skipping %s, %s was not found on the PATH' % (vcs,
+                    name)
+                continue
+            sublime.overrides[setting_name] = executable
+
+            rand = random.Random(options.seed)
+            root_dir = create(work_dir, executable)
+            files = generate_files(root_dir, options, rand)
+            commit(root_dir, executable)
+            files.extend(change_files(root_dir, files, options, rand))
+            rand.shuffle(files)
+            dirs = list(set([os.path.dirname(path) for path in files]))
+            rand.shuffle(dirs)
+
+            results = benchmark(root_dir, files, dirs, options)
+            print_results(vcs, len(files), results)
+            report[vcs] = dict(results)
+            stop_helpers()
+    finally:
+        if not options.keep and not options.dir:
+            remove_tree(work_dir)
+
+    if sublime.errors:
+        print 'Errors shown while benchmarking:'
+        for message in sublime.errors:
+            print '  ' + message
+
+    if options.json:
+        f = open(options.json, 'w')
+        try:
+            json.dump({'options': options.__dict__, 'results': report}, f,
+                indent=4)
+        finally:
+            f.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# A stand-in for the sublime module, so Tortoise.py can be imported and
+# benchmarked outside of Sublime Text. Settings come from the package's
+# Tortoise.sublime-settings, with overrides from the benchmark.
+
+import os.path
+
+try:
+    import json
+except (ImportError):
+    json = None
+
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+overrides = {}
+settings = {}
+errors = []
+
+
+def read_default_settings():
+    path = os.path.join(package_dir, 'Tortoise.sublime-settings')
+    lines = []
+    for line in open(path, 'rb').read().splitlines():
+        if not line.strip().startswith('//'):
+            lines.append(line)
+    return json.loads('\n'.join(lines))
+
+
+class Settings():
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, name, default=None):
+        if name in overrides:
+            return overrides[name]
+        return self.values.get(name, default)
+
+    def set(self, name, value):
+        overrides[name] = value
+
+    def add_on_change(self, key, callback):
+        pass
+
+
+def load_settings(name):
+    if name not in settings:
+        values = {}
+        if json != None:
+            values = read_default_settings()
+        settings[name] = Settings(values)
+    return settings[name]
+
+
+def packages_path():
+    return os.path.dirname(package_dir)
+
+
+def error_message(message):
+    errors.append(message)
+
+
+def status_message(message):
+    pass
+
+
+# Callbacks run right away on the calling thread, which is good enough
+# since nothing is drawn
+def set_timeout(callback, delay):
+    callback()
+
+
+def active_window():
+    return None
+
+
+def windows():
+    return []
@@ -0,0 +1,25 @@
+# A stand-in for the sublime_plugin module, see sublime.py
+
+
+class ApplicationCommand():
+    pass
+
+
+class WindowCommand():
+    def __init__(self, window):
+        self.window = window
+
+    def is_visible(self, *args, **kwargs):
+        return True
+
+    def is_enabled(self, *args, **kwargs):
+        return True
+
+
+class TextCommand():
+    def __init__(self, view):
+        self.view = view
+
+
+class EventListener():
+    pass
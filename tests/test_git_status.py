@@ -0,0 +1,152 @@
+# Compares the native git status reader with git status --porcelain on
+# generated repositories. Run it with Python 2, e.g.
+#
+#   python tests/test_git_status.py
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest('Tortoise.py requires Python 2')
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(package_dir, 'bench'))
+sys.path.insert(1, package_dir)
+
+import Tortoise
+
+
+def git(root_dir, *args):
+    env = dict(os.environ)
+    env.update({'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@test',
+        'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@test',
+        'HOME': root_dir, 'XDG_CONFIG_HOME': root_dir})
+    proc = subprocess.Popen(['git'] + list(args), cwd=root_dir, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise Exception('git ' + ' '.join(args) + ' failed')
+    return output
+
+
+def write(root_dir, path, data):
+    path = os.path.join(root_dir, *path.split('/'))
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'wb').write(data)
+
+
+class GitStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.root_dir = os.path.join(self.temp_dir, 'repo')
+        os.mkdir(self.root_dir)
+        git(self.root_dir, 'init', '-q')
+        git(self.root_dir, 'config', 'core.autocrlf', 'false')
+        write(self.root_dir, '.gitignore', '*.log\nbuild/\n!keep.log\n')
+        for i in range(20):
+            write(self.root_dir, 'dir%d/sub/file%d.txt' % (i % 3, i),
+                ('line %d\n' % i) * (i * 50 + 1))
+        write(self.root_dir, 'script.sh', 'echo hello\n')
+        git(self.root_dir, 'add', '-A')
+        git(self.root_dir, 'commit', '-q', '-m', 'first')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_changes(self):
+        root_dir = self.root_dir
+        write(root_dir, 'dir0/sub/file0.txt', 'changed\n')
+        write(root_dir, 'dir1/sub/file1.txt', 'staged\n')
+        git(root_dir, 'add', 'dir1/sub/file1.txt')
+        os.remove(os.path.join(root_dir, 'dir2', 'sub', 'file2.txt'))
+        git(root_dir, 'rm', '-q', '--cached', 'dir0/sub/file3.txt')
+        os.chmod(os.path.join(root_dir, 'script.sh'), 0o755)
+        os.chmod(os.path.join(root_dir, 'dir1', 'sub', 'file4.txt'), 0o755)
+        git(root_dir, 'add', 'dir1/sub/file4.txt')
+        git(root_dir, 'mv', 'dir2/sub/file5.txt', 'dir2/moved.txt')
+        write(root_dir, 'added.txt', 'added\n')
+        git(root_dir, 'add', 'added.txt')
+        write(root_dir, 'untracked/new.txt', 'new\n')
+        write(root_dir, 'debug.log', 'ignored\n')
+        write(root_dir, 'keep.log', 'not ignored\n')
+        write(root_dir, 'build/output.txt', 'ignored\n')
+
+    def get_expected(self):
+        output = git(self.root_dir, 'status', '--porcelain', '-z', '-uall')
+        expected = {}
+        # Like Git.check_status, the first record for a path decides, e.g.
+        # D over ?? for a file removed with git rm --cached
+        for path, status in Tortoise.parse_git_status([output]):
+            path = os.path.join(self.root_dir, *path.split('/'))
+            if path not in expected:
+                expected[path] = status
+        return expected
+
+    def get_paths(self):
+        paths = []
+        for dir, dirs, files in os.walk(self.root_dir):
+            if '.git' in dirs:
+                dirs.remove('.git')
+            for file in files:
+                paths.append(os.path.join(dir, file))
+        for path in git(self.root_dir, 'ls-files', '-z').split('\0'):
+            if not path:
+                continue
+            path = os.path.join(self.root_dir, *path.split('/'))
+            if path not in paths:
+                paths.append(path)
+        return paths
+
+    def check_repository(self):
+        expected = self.get_expected()
+        repository = Tortoise.GitRepository(self.root_dir)
+        answered = 0
+        for path in self.get_paths():
+            status = repository.get_status(path)
+            if status == None:
+                continue
+            answered += 1
+            self.assertEqual(status, expected.get(path, ''),
+                '%s: %r != %r' % (path, status, expected.get(path, '')))
+        return answered
+
+    def test_clean(self):
+        self.assertEqual(self.check_repository(), len(self.get_paths()))
+
+    def test_changes(self):
+        self.make_changes()
+        self.assertTrue(self.check_repository() > 20)
+
+    def test_packed_objects(self):
+        self.make_changes()
+        git(self.root_dir, 'gc', '-q', '--aggressive')
+        self.assertTrue(self.check_repository() > 20)
+
+    def test_index_version_4(self):
+        self.make_changes()
+        git(self.root_dir, 'update-index', '--index-version', '4')
+        self.assertTrue(self.check_repository() > 20)
+
+    def test_exec_bit(self):
+        path = os.path.join(self.root_dir, 'script.sh')
+        os.chmod(path, 0o755)
+        repository = Tortoise.GitRepository(self.root_dir)
+        self.assertEqual(repository.get_status(path), 'M')
+
+    def test_rename(self):
+        git(self.root_dir, 'mv', 'script.sh', 'renamed.sh')
+        repository = Tortoise.GitRepository(self.root_dir)
+        path = os.path.join(self.root_dir, 'renamed.sh')
+        self.assertEqual(repository.get_status(path), None)
+        self.assertEqual(self.get_expected()[path], 'R')
+
+
+if __name__ == '__main__':
+    unittest.main()
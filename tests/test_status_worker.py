@@ -0,0 +1,100 @@
+# Checks that status requests queued on the status worker are all answered.
+# Run it with Python 2, e.g.
+#
+#   python tests/test_status_worker.py
+
+import sys
+import os
+import os.path
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest('Tortoise.py requires Python 2')
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(package_dir, 'bench'))
+sys.path.insert(1, package_dir)
+
+import sublime
+import Tortoise
+
+
+def git(root_dir, *args):
+    env = dict(os.environ)
+    env.update({'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@test',
+        'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@test'})
+    proc = subprocess.Popen(['git'] + list(args), cwd=root_dir, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    proc.communicate()
+    if proc.returncode != 0:
+        raise Exception('git ' + ' '.join(args) + ' failed')
+
+
+def wait_for_worker(timeout=30):
+    worker = Tortoise.status_worker
+    end = time.time() + timeout
+    while time.time() < end:
+        with worker.lock:
+            if not worker.pending and worker.queue.empty():
+                return
+        time.sleep(0.01)
+    raise Exception('The status worker is still busy')
+
+
+class StatusWorkerTest(unittest.TestCase):
+    def setUp(self):
+        sublime.overrides.update({'persistent_cache': False,
+            'native_status': True})
+        self.temp_dir = tempfile.mkdtemp()
+        self.root_dir = os.path.join(self.temp_dir, 'repo')
+        os.makedirs(os.path.join(self.root_dir, 'sub'))
+        open(os.path.join(self.root_dir, 'a.txt'), 'wb').write('a\n')
+        open(os.path.join(self.root_dir, 'sub', 'b.txt'), 'wb').write('b\n')
+        git(self.root_dir, 'init', '-q')
+        git(self.root_dir, 'add', '-A')
+        git(self.root_dir, 'commit', '-q', '-m', 'first')
+        open(os.path.join(self.root_dir, 'sub', 'b.txt'), 'wb').write('c\n')
+        Tortoise.status_cache.clear()
+
+    def tearDown(self):
+        wait_for_worker()
+        Tortoise.status_cache.clear()
+        shutil.rmtree(self.temp_dir)
+
+    def test_different_paths(self):
+        file_path = os.path.join(self.root_dir, 'a.txt')
+        dir_path = os.path.join(self.root_dir, 'sub')
+        vcs = Tortoise.TortoiseCommand().get_vcs(file_path)
+
+        # Keeps both requests queued until the worker is released
+        event = threading.Event()
+        Tortoise.status_worker.add('test block', 0, event.wait)
+        self.assertEqual(vcs.get_status(file_path, False), None)
+        self.assertEqual(vcs.get_status(dir_path, False), None)
+        event.set()
+        wait_for_worker()
+
+        self.assertEqual(vcs.get_cached_status(file_path, None), '')
+        self.assertEqual(vcs.get_cached_status(dir_path, None), 'M')
+
+    def test_same_path(self):
+        path = os.path.join(self.root_dir, 'sub', 'b.txt')
+        vcs = Tortoise.TortoiseCommand().get_vcs(path)
+        event = threading.Event()
+        Tortoise.status_worker.add('test block', 0, event.wait)
+        vcs.get_status(path, False)
+        vcs.get_status(path, False)
+        self.assertEqual(len(Tortoise.status_worker.pending), 2)
+        event.set()
+        wait_for_worker()
+        self.assertEqual(vcs.get_cached_status(path, None), 'M')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# Compares the native SVN status reader with svn status on generated
+# working copies, and checks it against a hand-made wc.db where svn isn't
+# installed. Run it with Python 2, e.g.
+#
+#   python tests/test_svn_status.py
+
+import sys
+import os
+import os.path
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import unittest
+import subprocess
+from distutils.spawn import find_executable
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest('Tortoise.py requires Python 2')
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, os.path.join(package_dir, 'bench'))
+sys.path.insert(1, package_dir)
+
+import Tortoise
+
+svn_path = find_executable('svn')
+svnadmin_path = find_executable('svnadmin')
+
+
+def run(cwd, *args):
+    proc = subprocess.Popen(list(args), cwd=cwd, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise Exception(' '.join(args) + ' failed')
+    return output
+
+
+def write(root_dir, path, data):
+    path = os.path.join(root_dir, *path.split('/'))
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'wb').write(data)
+
+
+class SVNStatusTest(unittest.TestCase):
+    def setUp(self):
+        if svn_path == None or svnadmin_path == None:
+            self.skipTest('svn and svnadmin were not found on the PATH')
+        self.temp_dir = tempfile.mkdtemp()
+        repository = os.path.join(self.temp_dir, 'repository')
+        run(self.temp_dir, svnadmin_path, 'create', repository)
+        url = 'file:///' + repository.replace(os.sep, '/').lstrip('/')
+        self.root_dir = os.path.join(self.temp_dir, 'wc')
+        run(self.temp_dir, svn_path, 'checkout', '-q', url, self.root_dir)
+        for i in range(10):
+            write(self.root_dir, 'dir/sub%d/file%d.txt' % (i % 2, i),
+                'line %d\n' % i)
+        write(self.root_dir, 'top.txt', 'top\n')
+        self.svn('add', '-q', 'dir', 'top.txt')
+        self.svn('commit', '-q', '-m', 'first')
+        self.svn('update', '-q')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def svn(self, *args):
+        return run(self.root_dir, svn_path, *args)
+
+    def make_changes(self):
+        root_dir = self.root_dir
+        write(root_dir, 'dir/sub0/file0.txt', 'changed\n')
+        self.svn('copy', '-q', 'dir', 'copied')
+        write(root_dir, 'copied/sub1/file1.txt', 'changed in the copy\n')
+        self.svn('delete', '-q', 'dir/sub1/file3.txt')
+        write(root_dir, 'new.txt', 'new\n')
+        self.svn('add', '-q', 'new.txt')
+        write(root_dir, 'added/inner.txt', 'added\n')
+        self.svn('add', '-q', 'added')
+        write(root_dir, 'untracked.txt', 'untracked\n')
+
+    def get_expected(self):
+        output = self.svn('status', '-v')
+        expected = {}
+        for path, status in Tortoise.parse_svn_status([output], True):
+            expected[os.path.join(self.root_dir, path)] = status
+        return expected
+
+    def get_paths(self):
+        paths = []
+        for dir, dirs, files in os.walk(self.root_dir):
+            if '.svn' in dirs:
+                dirs.remove('.svn')
+            for name in dirs + files:
+                paths.append(os.path.join(dir, name))
+        paths.append(os.path.join(self.root_dir, 'dir', 'sub1', 'file3.txt'))
+        return paths
+
+    def check_working_copy(self):
+        expected = self.get_expected()
+        working_copy = Tortoise.SVNWorkingCopy(self.root_dir)
+        answered = 0
+        for path in self.get_paths():
+            status = working_copy.get_status(path)
+            if status == None:
+                continue
+            answered += 1
+            self.assertEqual(status, expected.get(path, ''),
+                '%s: %r != %r' % (path, status, expected.get(path, '')))
+        return answered
+
+    def test_clean(self):
+        self.assertTrue(self.check_working_copy() > 10)
+
+    def test_changes(self):
+        self.make_changes()
+        self.assertTrue(self.check_working_copy() > 20)
+
+
+# A working copy with a copied folder, described by a wc.db with just the
+# tables and columns SVNWorkingCopy reads
+class SVNCopiedFolderTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.root_dir = os.path.join(self.temp_dir, 'wc')
+        os.makedirs(os.path.join(self.root_dir, '.svn'))
+        connection = sqlite3.connect(os.path.join(self.root_dir, '.svn',
+            'wc.db'))
+        cursor = connection.cursor()
+        cursor.execute('CREATE TABLE WCROOT (id INTEGER, local_abspath TEXT)')
+        cursor.execute('CREATE TABLE NODES (wc_id INTEGER, local_relpath ' +
+            'TEXT, op_depth INTEGER, presence TEXT, kind TEXT, checksum ' +
+            'TEXT, translated_size INTEGER, last_mod_time INTEGER, ' +
+            'properties BLOB)')
+        cursor.execute('CREATE TABLE ACTUAL_NODE (wc_id INTEGER, ' +
+            'local_relpath TEXT, properties BLOB, conflict_data BLOB)')
+        cursor.execute('INSERT INTO WCROOT VALUES (1, NULL)')
+        nodes = [('', 0, 'dir', None), ('dir', 0, 'dir', None),
+            ('dir/same.txt', 0, 'file', 'same\n'),
+            ('dir/changed.txt', 0, 'file', 'changed\n'),
+            ('copied', 1, 'dir', None),
+            ('copied/same.txt', 1, 'file', 'same\n'),
+            ('copied/changed.txt', 1, 'file', 'changed\n'),
+            ('added', 1, 'dir', None), ('added/new.txt', 2, 'file', None)]
+        for relpath, op_depth, kind, data in nodes:
+            checksum = None
+            if data != None:
+                sha = hashlib.sha1(data).hexdigest()
+                checksum = '$sha1$' + sha
+                write(self.root_dir, '.svn/pristine/%s/%s.svn-base' % (
+                    sha[0:2], sha), data)
+                write(self.root_dir, relpath, data)
+            elif kind == 'file':
+                write(self.root_dir, relpath, 'new\n')
+            elif relpath:
+                os.makedirs(os.path.join(self.root_dir, relpath))
+            cursor.execute('INSERT INTO NODES VALUES (1, ?, ?, ?, ?, ?, ' +
+                'NULL, NULL, NULL)', (relpath, op_depth, 'normal', kind,
+                checksum))
+        connection.commit()
+        connection.close()
+        write(self.root_dir, 'copied/changed.txt', 'edited\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_status(self, relpath):
+        working_copy = Tortoise.SVNWorkingCopy(self.root_dir)
+        return working_copy.get_status(os.path.join(self.root_dir,
+            *relpath.split('/')))
+
+    def test_copy_root(self):
+        self.assertEqual(self.get_status('copied'), 'A')
+
+    def test_copied_files(self):
+        self.assertEqual(self.get_status('copied/same.txt'), '')
+        self.assertEqual(self.get_status('copied/changed.txt'), 'M')
+
+    def test_added_files(self):
+        self.assertEqual(self.get_status('added'), 'A')
+        self.assertEqual(self.get_status('added/new.txt'), 'A')
+        self.assertEqual(self.get_status('dir/same.txt'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()